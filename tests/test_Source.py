@@ -0,0 +1,62 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+from queue import Queue
+from typing import Any
+
+# Like the scripts of thermopro: run from the repo, with thermopro on the path for constants
+ROOT: str = os.path.join(os.path.dirname(__file__), '..')
+sys.path[0:0] = [ROOT, os.path.join(ROOT, 'thermopro')]
+
+from thermopro.Collector import Collector
+from thermopro.Source import Source
+
+
+# A source whose collect() runs a blocking thread of THREAD_SECONDS, like Neviweb or the rtl_433 run of a scan
+class SlowSource(Source):
+    name: str = 'slow'
+    THREAD_SECONDS: float = 2
+
+    def __init__(self):
+        super().__init__()
+        self.collects: int = 0
+
+    def load(self, result_queue: Queue) -> None:
+        time.sleep(SlowSource.THREAD_SECONDS)
+        result_queue.put({'slow_value': self.collects})
+
+    async def collect(self) -> dict[str, Any]:
+        self.collects += 1
+        return await self.in_thread(self.load)
+
+
+class TestSource(unittest.TestCase):
+
+    def test_poll_after_timeout_waits_for_the_thread(self):
+        source: SlowSource = SlowSource()
+        self.assertEqual(Collector({source.name: source.poll}, timeouts={source.name: 0.5}).run(), {})
+        self.assertTrue(source.busy())
+
+        # Waits for the thread of the cancelled poll, without starting another one
+        start: float = time.perf_counter()
+        asyncio.run(source.poll())
+        self.assertLess(time.perf_counter() - start, SlowSource.THREAD_SECONDS + 1)
+        self.assertEqual(source.collects, 1)
+        self.assertFalse(source.busy())
+
+        # Not stuck: the next poll collects again
+        self.assertEqual(asyncio.run(source.poll()), {'slow_value': 2})
+        self.assertFalse(source.busy())
+
+    def test_failed_poll_is_not_kept(self):
+        source: Source = Source()
+        source.collect = lambda: asyncio.sleep(0, {'kwh_dict': {}})
+        asyncio.run(source.poll())
+        self.assertIsNone(source.latest_time)
+        self.assertFalse(source.busy())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from typing import Any
+
+# Like the scripts of thermopro: run from the repo, with thermopro on the path for constants
+ROOT: str = os.path.join(os.path.dirname(__file__), '..')
+sys.path[0:0] = [ROOT, os.path.join(ROOT, 'thermopro')]
+
+from thermopro.Rtl433Temperature2 import Rtl433Temperature2
+from thermopro.TransmitSchedule import TransmitSchedule
+
+MODEL: str = 'Test-Sensor'
+# Seconds between two bursts of the sensor, its first one FIRST seconds after rtl_433 started
+PERIOD: float = 3
+FIRST: float = 0.5
+
+
+# rtl_433 in a scan hearing one sensor, a burst of one frame every PERIOD seconds
+class FakeSupervisor:
+
+    def __init__(self, args: list[str | int], pipe: bool = True):
+        self.started: float = 0
+        self.sent: int = 0
+
+    def start(self) -> None:
+        self.started, self.sent = time.monotonic(), 0
+
+    def stop(self) -> None:
+        pass
+
+    def done(self) -> bool:
+        return False
+
+    def read(self, timeout: float) -> dict[str, Any] | None:
+        wait: float = self.started + FIRST + self.sent * PERIOD - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return None
+        time.sleep(max(wait, 0))
+        self.sent += 1
+        return {'time': f'{datetime.now():%Y-%m-%d %H:%M:%S}', 'model': MODEL, 'id': 1, 'battery_ok': 1,
+                'temperature_C': 20.5, 'humidity': 50, 'freq': 433.92}
+
+
+class TestTransmitSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.rtl_433: Rtl433Temperature2 = Rtl433Temperature2()
+        self.rtl_433.schedule = TransmitSchedule(f'{self.directory.name}/TransmitSchedule.json')
+        self.supervisor: type = sys.modules['thermopro.Rtl433Temperature2'].Rtl433Supervisor
+        sys.modules['thermopro.Rtl433Temperature2'].Rtl433Supervisor = FakeSupervisor
+
+    def tearDown(self):
+        sys.modules['thermopro.Rtl433Temperature2'].Rtl433Supervisor = self.supervisor
+        self.directory.cleanup()
+
+    def capture(self) -> dict[str, Any]:
+        json_rtl_433: dict[str, Any] = {}
+        self.rtl_433._Rtl433Temperature2__pipe_sensors([], {MODEL: 'ext'}, json_rtl_433, [], [], [], [], [], [])
+        return json_rtl_433
+
+    def test_period_learned_from_a_capture_of_a_scan(self):
+        start: float = time.monotonic()
+        self.assertEqual(self.capture().get(f'ext_temp_{MODEL}'), 20.5)
+        # Listened for the next burst, not until the -T of the capture
+        self.assertLess(time.monotonic() - start, FIRST + 2 * PERIOD + 1)
+        self.assertAlmostEqual(self.rtl_433.schedule.period(MODEL), PERIOD, delta=0.5)
+
+        # Known: the next capture ends with the first burst
+        start = time.monotonic()
+        self.assertEqual(self.capture().get(f'ext_temp_{MODEL}'), 20.5)
+        self.assertLess(time.monotonic() - start, PERIOD + 1)
+
+    def test_period_unknown_from_one_arrival_per_capture(self):
+        schedule: TransmitSchedule = self.rtl_433.schedule
+        for hour in range(4):
+            schedule.arrive(MODEL, datetime(2026, 1, 1, hour, 1, 7 * hour))
+        self.assertIsNone(schedule.period(MODEL))
+
+
+if __name__ == '__main__':
+    unittest.main()
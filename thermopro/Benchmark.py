@@ -0,0 +1,247 @@
+import glob
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+import zipfile
+from collections.abc import Callable
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+import thermopro
+from thermopro import log
+from thermopro.Codec import Codec
+from thermopro.ColumnEncoding import ColumnEncoding
+from thermopro.ColumnarFile import ColumnarFile
+from thermopro.HistoryStore import HistoryStore
+from thermopro.JsonRecordsReader import JsonRecordsReader
+from thermopro.constants import COLUMNS, SCHEMA, SENSORS_KEYS, THERMO_PRO_SCAN_COLUMNS_PATH
+
+
+def sample_history(rows: int, start: str = '2024-01-01') -> DataFrame:
+    rng: np.random.Generator = np.random.default_rng(0)
+    times: pd.DatetimeIndex = pd.date_range(start, periods=rows, freq='h')
+    data: dict[str, object] = {}
+    for col in COLUMNS:
+        if SCHEMA[col] == 'datetime64[ns]':
+            data[col] = times if col == 'time' else times.normalize() + pd.Timedelta(hours=6)
+        elif SCHEMA[col] == 'str':
+            data[col] = ['Clouds, few clouds'] * rows
+        elif SCHEMA[col] == 'int64':
+            data[col] = rng.integers(20, 100, rows).astype('float64')
+        else:
+            data[col] = np.round(20 + np.cumsum(rng.normal(0, 0.1, rows)), 2)
+    df: DataFrame = pd.DataFrame(data)
+    # Some holes, like the rows where a source did not answer
+    for col in [col for col in COLUMNS if SCHEMA[col] in ['int64', 'float64']]:
+        df.loc[df.sample(frac=0.02, random_state=1).index, col] = np.nan
+    return df
+
+
+# set_astype as it was before the SCHEMA, kept to compare against
+def legacy_set_astype(df: DataFrame) -> DataFrame:
+    columns = list(COLUMNS)
+    for col in ['time', 'open_sunrise', 'open_sunset']:
+        df = df.astype({col: 'datetime64[ns]'})
+        columns.remove(col)
+    for col in ['ext_humidex', 'ext_humidity', 'int_humidity', 'open_clouds', 'open_humidity', 'open_pressure',
+                'open_visibility', 'open_wind_deg']:
+        df[col] = df[col].round().astype('Int64')
+        df[col] = df[col].apply(lambda x: 0 if pd.isna(x) else x)
+        columns.remove(col)
+    for col in ['open_description', 'open_icon']:
+        df[col] = df[col].astype(str)
+        columns.remove(col)
+    for col in columns:
+        df[col] = df[col].astype('Float64')
+        df[col] = df[col].apply(lambda x: 0.0 if pd.isna(x) else x)
+
+    all_columns2: list[str] = sorted(df.columns.tolist())
+    all_columns2.remove('time')
+    all_columns2 = ['time'] + all_columns2
+    df = df[all_columns2]
+    df = df.sort_values(by='time', ascending=True)
+    df['kwh_hydro_quebec'] = df['kwh_hydro_quebec'].apply(lambda x: 0.0 if pd.isna(x) else x)
+    df['kwh_neviweb'] = df['kwh_neviweb'].apply(lambda x: 0.0 if pd.isna(x) else x)
+    return df
+
+
+def timed(function: Callable[[], object], repeat: int = 3) -> float:
+    best: float = float('inf')
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_set_astype(rows_list: list[int]) -> None:
+    log.info(' set_astype '.center(100, '*'))
+    for rows in rows_list:
+        df: DataFrame = sample_history(rows)
+        legacy: float = timed(lambda: legacy_set_astype(df.copy()))
+        current: float = timed(lambda: thermopro.set_astype(df.copy()))
+        same: bool = legacy_set_astype(df.copy()).astype(SCHEMA).equals(thermopro.set_astype(df.copy()))
+        log.info(f'rows: {rows:>7}, legacy: {legacy * 1e6 / rows:>8.2f} µs/row, schema: {current * 1e6 / rows:>8.2f} '
+                 f'µs/row, speedup: {legacy / current:>6.1f}x, same result: {same}')
+
+
+def sample_sensors(rows: int, start: str = '2024-01-01') -> DataFrame:
+    rng: np.random.Generator = np.random.default_rng(0)
+    times: pd.DatetimeIndex = pd.date_range(start, periods=rows // 8 + 1, freq='h')
+    df: DataFrame = pd.DataFrame([(t, sensor_id, metric) for t in times for sensor_id in [1, 2] for metric in range(4)],
+                                 columns=SENSORS_KEYS)[:rows]
+    df['value'] = np.round(np.where(df['metric'] % 2 == 0, 20, 50) + rng.normal(0, 0.5, len(df)), 1)
+    return df
+
+
+# The history as save_json wrote it before the store: records with indent=4 in a LZMA 9 zip
+def legacy_save_json(df: DataFrame) -> bytes:
+    buffer: io.BytesIO = io.BytesIO()
+    df.to_json(buffer, orient='records', indent=4, date_format='iso',
+               compression={'method': 'zip', 'compression': zipfile.ZIP_LZMA, 'compresslevel': 9})
+    return buffer.getvalue()
+
+
+def legacy_load_json(data: bytes) -> DataFrame:
+    return pd.read_json(io.BytesIO(data), compression='zip', orient='records')
+
+
+# Sealed segments of a store written in a temporary folder: the last row in the next month seals the active log
+def write_segments(df: DataFrame, keys: list[str], segment_format: str) -> HistoryStore:
+    store: HistoryStore = HistoryStore(tempfile.mkdtemp(), keys=keys, segment_format=segment_format)
+    store.write(df.iloc[:-1])
+    last: DataFrame = df.iloc[-1:].copy()
+    last['time'] = pd.to_datetime(df['time']).max().normalize() + pd.offsets.MonthBegin(1)
+    store.append(last)
+    return store
+
+
+def segments_size(store: HistoryStore) -> int:
+    return sum(os.path.getsize(file) for file in glob.glob(f'{store.path}/*.zip'))
+
+
+def benchmark_encoding(rows_list: list[int]) -> None:
+    log.info(' encoding '.center(100, '*'))
+    for name, sample, keys in [('ThermoProScan', lambda rows: thermopro.set_astype(sample_history(rows)), ['time']),
+                               ('Sensors', sample_sensors, SENSORS_KEYS)]:
+        for rows in rows_list:
+            df: DataFrame = sample(rows)
+            data: bytes = legacy_save_json(df)
+            log.info(f'{name}, rows: {rows:>7}, legacy save_json: {len(data):>10} bytes, '
+                     f'write: {timed(lambda: legacy_save_json(df), 1) * 1e6 / rows:>7.2f} µs/row, '
+                     f'read: {timed(lambda: legacy_load_json(data), 1) * 1e6 / rows:>7.2f} µs/row')
+            for segment_format in ['columns', 'encoded']:
+                stores: list[HistoryStore] = []
+                write: float = timed(lambda: stores.append(write_segments(df, keys, segment_format)), 1)
+                store: HistoryStore = stores[0]
+                loaded: list[DataFrame] = []
+                read: float = timed(lambda: loaded.append(store.load()), 1)
+                expected: DataFrame = df.iloc[:-1].sort_values(by=keys).reset_index(drop=True)
+                same: bool = loaded[0].iloc[:-1][expected.columns].astype(expected.dtypes.to_dict()).equals(expected)
+                log.info(f'{name}, rows: {rows:>7}, {segment_format:>15}: {segments_size(store):>10} bytes, '
+                         f'write: {write * 1e6 / rows:>7.2f} µs/row, read: {read * 1e6 / rows:>7.2f} µs/row, '
+                         f'round trip: {same}')
+                for each in stores:
+                    shutil.rmtree(each.path)
+
+
+CODEC_CANDIDATES: list[str] = ['stored', 'deflate-1', 'deflate-6', 'deflate-9', 'bz2-9', 'lzma-0', 'lzma-6', 'lzma-9',
+                                'zstd-1', 'zstd-3', 'zstd-9', 'zstd-19']
+
+
+# What each use really compresses: the encoded columns of every month of the history, and the files of the backups
+def real_payloads() -> dict[str, list[bytes]]:
+    df: DataFrame = thermopro.query()
+    segment: list[bytes] = []
+    for _, df_month in df.groupby(df['time'].dt.strftime('%Y-%m')):
+        for col in df_month.columns:
+            segment.append(ColumnEncoding.encode(df_month[col], ColumnEncoding.kind(df_month[col])))
+    backup: list[bytes] = []
+    for file in HistoryStore().files() + thermopro.get_sensors_store().files():
+        with open(file, 'rb') as f:
+            backup.append(f.read())
+    return {'segment': segment, 'backup': backup}
+
+
+def benchmark_codecs() -> None:
+    log.info(' codecs '.center(100, '*'))
+    for use, payloads in real_payloads().items():
+        size: int = sum(len(payload) for payload in payloads)
+        default: str = Codec.for_use(use, zip_member=use == 'backup').name
+        log.info(f'{use}: {len(payloads)} payloads, {size} bytes, default codec: {default}')
+        for name in CODEC_CANDIDATES:
+            codec: Codec = Codec(name)
+            if not codec.available(zip_member=use == 'backup'):
+                log.info(f'{use}, {name:>10}: not available')
+                continue
+            compressed: list[list[bytes]] = []
+            write: float = timed(lambda: compressed.append([codec.compress(payload) for payload in payloads]), 1)
+            read: float = timed(lambda: [codec.decompress(payload) for payload in compressed[0]], 1)
+            ratio: float = size / max(sum(len(payload) for payload in compressed[0]), 1)
+            log.info(f'{use}, {name:>10}: ratio: {ratio:>6.2f}, compress: {size / write / 1e6:>8.2f} MB/s, '
+                     f'decompress: {size / read / 1e6:>8.2f} MB/s{' <- default' if name == default else ''}')
+
+
+def benchmark_graph_load() -> None:
+    log.info(' graph load '.center(100, '*'))
+    columns: list[str] = ['time', 'ext_temp', 'int_temp', 'ext_humidity', 'int_humidity', 'kwh_hydro_quebec']
+    version: int = HistoryStore().read_manifest()['version']
+    thermopro.update_columns()
+    query: float = timed(lambda: thermopro.query(columns=columns))
+    mapped: float = timed(lambda: ColumnarFile(THERMO_PRO_SCAN_COLUMNS_PATH).read(columns=columns, version=version))
+    log.info(f'query: {query * 1e3:>8.2f} ms, memmap: {mapped * 1e3:>8.2f} ms, speedup: {query / mapped:>6.1f}x')
+
+
+def peak_memory(function: Callable[[], object]) -> tuple[float, int]:
+    tracemalloc.start()
+    start: float = time.perf_counter()
+    try:
+        function()
+        return time.perf_counter() - start, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# pandas.read_json of the legacy file against JsonRecordsReader, whole frame and chunk by chunk (the migration)
+def benchmark_legacy_read(rows_list: list[int]) -> None:
+    log.info(' legacy read '.center(100, '*'))
+    for rows in rows_list:
+        file: str = f'{tempfile.mkdtemp()}/ThermoProScan.json.zip'
+        with open(file, 'wb') as f:
+            f.write(legacy_save_json(thermopro.set_astype(sample_history(rows))))
+        frame_bytes: int = int(thermopro.set_astype(sample_history(rows)).memory_usage(deep=True).sum())
+        results: dict[str, tuple[float, int]] = {
+            'read_json': peak_memory(lambda: pd.read_json(file, compression='zip', orient='records')),
+            'reader': peak_memory(lambda: JsonRecordsReader(file, dtypes=SCHEMA).read()),
+            'chunks': peak_memory(lambda: sum(len(df) for df in JsonRecordsReader(file, dtypes=SCHEMA).chunks())),
+        }
+        for name, (seconds, peak) in results.items():
+            log.info(f'rows: {rows:>7}, {name:>9}: {seconds:>7.2f} s, peak: {peak / 2 ** 20:>8.1f} MB, '
+                     f'{peak / frame_bytes:>5.1f}x the DataFrame')
+        shutil.rmtree(os.path.dirname(file))
+
+
+if __name__ == '__main__':
+    thermopro.set_up(__file__)
+    try:
+        benchmarks: list[str] = sys.argv[1:] if len(sys.argv) > 1 else ['set_astype']
+        if 'set_astype' in benchmarks:
+            benchmark_set_astype([1_000, 10_000, 100_000])
+        if 'encoding' in benchmarks:
+            benchmark_encoding([10_000, 100_000])
+        if 'codecs' in benchmarks:
+            benchmark_codecs()
+        if 'graph_load' in benchmarks:
+            benchmark_graph_load()
+        if 'legacy_read' in benchmarks:
+            benchmark_legacy_read([10_000, 100_000])
+    except Exception as ex:
+        log.error(ex)
+        log.error(traceback.format_exc())
@@ -0,0 +1,72 @@
+import bz2
+import lzma
+import zipfile
+import zlib
+from types import ModuleType
+
+from thermopro import log
+from thermopro.constants import CODECS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard: ModuleType | None = None
+
+ZIP_METHODS: dict[str, int] = {'stored': zipfile.ZIP_STORED, 'deflate': zipfile.ZIP_DEFLATED, 'bz2': zipfile.ZIP_BZIP2,
+                               'lzma': zipfile.ZIP_LZMA}
+if hasattr(zipfile, 'ZIP_ZSTANDARD'):
+    ZIP_METHODS['zstd'] = zipfile.ZIP_ZSTANDARD
+
+
+# A compression algorithm and its level, named like 'deflate-6', 'lzma-9', 'zstd-3' or 'stored'.
+# compress() and decompress() work on bytes (the members of the segments, stored as is in their zip),
+# zip_args() gives the arguments of zipfile for the backups. zstd needs the zstandard package.
+class Codec:
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self.algorithm: str = name.split('-')[0]
+        self.level: int | None = int(name.split('-')[1]) if '-' in name else None
+        if self.algorithm not in ['stored', 'deflate', 'bz2', 'lzma', 'zstd']:
+            raise ValueError(f'Unknown codec: {name}')
+
+    @staticmethod
+    def for_use(use: str, zip_member: bool = False) -> 'Codec':
+        """First available codec of CODECS[use], zip_member when zipfile itself must compress it."""
+        for name in CODECS[use]:
+            codec: Codec = Codec(name)
+            if codec.available(zip_member):
+                return codec
+        log.warning(f'No codec of {CODECS[use]} available for {use}, stored')
+        return Codec('stored')
+
+    def available(self, zip_member: bool = False) -> bool:
+        if zip_member:
+            return self.algorithm in ZIP_METHODS
+        return self.algorithm != 'zstd' or zstandard is not None
+
+    def compress(self, data: bytes) -> bytes:
+        if self.algorithm == 'deflate':
+            return zlib.compress(data, self.level if self.level is not None else 6)
+        if self.algorithm == 'bz2':
+            return bz2.compress(data, self.level if self.level is not None else 9)
+        if self.algorithm == 'lzma':
+            return lzma.compress(data, preset=self.level if self.level is not None else 6)
+        if self.algorithm == 'zstd':
+            return zstandard.ZstdCompressor(level=self.level if self.level is not None else 3).compress(data)
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.algorithm == 'deflate':
+            return zlib.decompress(data)
+        if self.algorithm == 'bz2':
+            return bz2.decompress(data)
+        if self.algorithm == 'lzma':
+            return lzma.decompress(data)
+        if self.algorithm == 'zstd':
+            return zstandard.ZstdDecompressor().decompress(data)
+        return data
+
+    def zip_args(self) -> dict[str, int | None]:
+        # zipfile ignores the level of lzma
+        return {'compression': ZIP_METHODS[self.algorithm], 'compresslevel': self.level}
@@ -0,0 +1,94 @@
+import asyncio
+import time
+import traceback
+from collections.abc import Callable, Coroutine
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Queue
+from typing import Any
+
+from thermopro import log
+from thermopro.constants import SOURCE_TIMEOUTS, SOURCE_DEADLINES
+
+
+# Runs the sources of a scan concurrently in one event loop, each one within its own timeout (SOURCE_TIMEOUTS), and
+# merges their results as they arrive: a scan lasts as long as its slowest source, never longer than its timeout.
+# With a commit, the row doesn't wait that long: commit() gets what arrived once every source answered or is past its
+# deadline (SOURCE_DEADLINES), then patch() gets the whole result again each time a late source answers.
+# A source is a coroutine giving a dict of values. The blocking ones (requests, rtl_433) run in the threads of
+# executor, see in_thread(): a thread can't be interrupted, its late result is dropped and the thread ends on its own.
+class Collector:
+    # Not the default executor of the loop: asyncio.run() would wait for the threads of the sources out of time
+    executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='source')
+
+    def __init__(self, sources: dict[str, Callable[[], Coroutine[Any, Any, dict[str, Any]]]],
+                 timeouts: dict[str, float] | None = None, deadlines: dict[str, float] | None = None):
+        self.sources: dict[str, Callable[[], Coroutine[Any, Any, dict[str, Any]]]] = sources
+        self.timeouts: dict[str, float] = timeouts if timeouts is not None else SOURCE_TIMEOUTS
+        self.deadlines: dict[str, float] = deadlines if deadlines is not None else SOURCE_DEADLINES
+
+    def run(self, commit: Callable[[dict[str, Any]], None] | None = None,
+            patch: Callable[[dict[str, Any]], None] | None = None) -> dict[str, Any]:
+        return asyncio.run(self.collect(commit, patch))
+
+    async def collect(self, commit: Callable[[dict[str, Any]], None] | None = None,
+                      patch: Callable[[dict[str, Any]], None] | None = None) -> dict[str, Any]:
+        json_data: dict[str, Any] = {}
+        tasks: dict[asyncio.Task, str] = {asyncio.create_task(self.__run(name, source), name=name): name for
+                                          name, source in self.sources.items()}
+        if commit is None:
+            for task in asyncio.as_completed(tasks):
+                json_data.update(await task)
+            return json_data
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        start: float = loop.time()
+        pending: set[asyncio.Task] = set(tasks)
+        while len(pending) > 0:
+            deadline: float = start + max(self.deadlines.get(tasks[task], float('inf')) for task in pending)
+            if deadline <= loop.time():
+                break
+            done, pending = await asyncio.wait(pending, timeout=deadline - loop.time(),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                json_data.update(task.result())
+        if len(pending) > 0:
+            log.warning(f'Committing at {loop.time() - start:.1f} s without {sorted(tasks[task] for task in pending)}')
+        # In the thread of the loop: the late sources wait for the row to be committed
+        commit(dict(json_data))
+
+        for task in asyncio.as_completed(pending):
+            result: dict[str, Any] = await task
+            if len(result) > 0:
+                json_data.update(result)
+                log.info(f'Late source at {loop.time() - start:.1f} s: {list(result.keys())}')
+                if patch is not None:
+                    patch(dict(json_data))
+        return json_data
+
+    async def __run(self, name: str, source: Callable[[], Coroutine[Any, Any, dict[str, Any]]]) -> dict[str, Any]:
+        start: float = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.timeouts.get(name)):
+                result: dict[str, Any] = await source()
+            log.info(f'Source {name}: {len(result)} values in {time.perf_counter() - start:.1f} s')
+            return result
+        except TimeoutError:
+            log.error(f'Source {name} timed out after {self.timeouts.get(name)} s, cancelled')
+        except Exception as ex:
+            log.error(f'Source {name}: {ex}')
+            log.error(traceback.format_exc())
+        return {}
+
+    @staticmethod
+    async def in_thread(function: Callable[[Queue], None], done: Callable[[], None] | None = None) -> dict[str, Any]:
+        """Runs a blocking source of the thread era, function(result_queue), in a thread of executor.
+        done() is called once the thread ends, even when the wait for it was cancelled by the timeout."""
+        result_queue: Queue = Queue()
+        future: Future = Collector.executor.submit(function, result_queue)
+        if done is not None:
+            future.add_done_callback(lambda _: done())
+        await asyncio.wrap_future(future)
+        result: dict[str, Any] = {}
+        while not result_queue.empty():
+            result.update(result_queue.get())
+        return result
@@ -0,0 +1,85 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+MAX_DECIMALS: int = 4
+# A missing value of a decimalN column
+NAN_INT: int = np.iinfo(np.int64).min
+
+
+# Binary encodings of a column, in the spirit of Gorilla (Facebook's time series database), but vectorized:
+#   dod   -> datetime64[ns], delta of delta of the epoch: 0 for every reading on the hourly clock
+#   delta -> int64, delta with the previous value: 0 while the value doesn't change
+#   decimalN -> float64 rounded to N decimals (all our readings), delta of the value * 10^N: 20.13 then 20.15 gives 2
+#   xor   -> other float64, bits XOR the bits of the previous value: the sign, exponent and first bits of the mantissa
+#            of a slowly changing value are 0. A decimal value like 20.13 has a noisy mantissa, hence decimalN.
+#   json  -> anything else (strings), like the 'columns' segments
+# Gorilla packs the leading and trailing zero bits of every value one by one. Here the 8 bytes of the values are
+# transposed instead (all the first bytes, then all the second bytes...), so the long runs of 0 are left to the
+# compression of the zip member.
+class ColumnEncoding:
+
+    @staticmethod
+    def kind(series: pd.Series) -> str:
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return 'dod'
+        if pd.api.types.is_integer_dtype(series) and not series.isna().any():
+            return 'delta'
+        if pd.api.types.is_float_dtype(series) or pd.api.types.is_integer_dtype(series):
+            values: np.ndarray = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            values = values[~np.isnan(values)]
+            for decimals in range(MAX_DECIMALS + 1):
+                scaled: np.ndarray = np.round(values * 10 ** decimals)
+                if np.array_equal(scaled / 10 ** decimals, values) and np.all(abs(scaled) < 2 ** 52):
+                    return f'decimal{decimals}'
+            return 'xor'
+        return 'json'
+
+    @staticmethod
+    def encode(series: pd.Series, kind: str) -> bytes:
+        if kind == 'dod':
+            values: np.ndarray = series.astype('datetime64[ns]').to_numpy().view(np.int64)
+            return ColumnEncoding.__shuffle(ColumnEncoding.__zigzag(np.diff(np.diff(values, prepend=0), prepend=0)))
+        if kind == 'delta':
+            values = series.to_numpy(dtype=np.int64)
+            return ColumnEncoding.__shuffle(ColumnEncoding.__zigzag(np.diff(values, prepend=0)))
+        if kind.startswith('decimal'):
+            floats: np.ndarray = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            values = np.where(np.isnan(floats), NAN_INT, np.round(np.nan_to_num(floats) * 10 ** int(kind[7:])))
+            return ColumnEncoding.__shuffle(ColumnEncoding.__zigzag(np.diff(values.astype(np.int64), prepend=0)))
+        if kind == 'xor':
+            bits: np.ndarray = series.to_numpy(dtype=np.float64, na_value=np.nan).view(np.uint64)
+            return ColumnEncoding.__shuffle(bits ^ np.concatenate([np.zeros(1, dtype=np.uint64), bits[:-1]]))
+        return series.to_json(orient='values', date_format='iso').encode('utf-8')
+
+    @staticmethod
+    def decode(data: bytes, kind: str) -> np.ndarray | list:
+        if kind == 'dod':
+            values: np.ndarray = np.cumsum(np.cumsum(ColumnEncoding.__unzigzag(ColumnEncoding.__unshuffle(data))))
+            return values.view('datetime64[ns]')
+        if kind == 'delta':
+            return np.cumsum(ColumnEncoding.__unzigzag(ColumnEncoding.__unshuffle(data)))
+        if kind.startswith('decimal'):
+            values = np.cumsum(ColumnEncoding.__unzigzag(ColumnEncoding.__unshuffle(data)))
+            return np.where(values == NAN_INT, np.nan, values.astype(np.float64) / 10 ** int(kind[7:]))
+        if kind == 'xor':
+            return np.bitwise_xor.accumulate(ColumnEncoding.__unshuffle(data)).view(np.float64)
+        return json.loads(data)
+
+    @staticmethod
+    def __zigzag(values: np.ndarray) -> np.ndarray:
+        # Small negative numbers become small positive numbers: -1 -> 1, 1 -> 2, -2 -> 3...
+        return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+    @staticmethod
+    def __unzigzag(values: np.ndarray) -> np.ndarray:
+        return ((values >> np.uint64(1)) ^ (np.uint64(0) - (values & np.uint64(1)))).view(np.int64)
+
+    @staticmethod
+    def __shuffle(values: np.ndarray) -> bytes:
+        return np.ascontiguousarray(values).view(np.uint8).reshape(-1, 8).T.tobytes()
+
+    @staticmethod
+    def __unshuffle(data: bytes) -> np.ndarray:
+        return np.frombuffer(data, dtype=np.uint8).reshape(8, -1).T.copy().view(np.uint64).ravel()
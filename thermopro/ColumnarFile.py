@@ -0,0 +1,185 @@
+import glob
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from thermopro import log
+from thermopro.HistoryStore import HistoryStore, GARBAGE_SECONDS
+
+LAYOUT_FILE = 'layout.json'
+INT16_MISSING: int = np.iinfo(np.int16).min
+
+
+# Fixed layout copy of a history, for the graphs: one raw file per column, opened with numpy.memmap so only the pages
+# of the plotted rows are read, no decompression or parsing at all:
+#   layout.json         -> rows, generation, version of the store it mirrors, storage of every column
+#   000001_time.bin     -> int64 epoch in ns, sorted
+#   000001_{col}.bin    -> float32 (floats) or int16 (ints, INT16_MISSING for a missing value)
+# Rows after the last one are appended in place: a graph only maps the rows of the layout it read. Known rows written
+# again are a copy of the files in a new generation, anything else (a row inserted in the middle, a new column) a
+# rebuild in a new generation: a graph may still have the old ones mapped, they never change under it and are
+# removed GARBAGE_SECONDS later (garbage of the layout).
+class ColumnarFile:
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self.layout_file: str = f'{path}/{LAYOUT_FILE}'
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.layout_file)
+
+    def read_layout(self) -> dict[str, Any] | None:
+        if not self.exists():
+            return None
+        with open(self.layout_file, 'r') as file:
+            return json.load(file)
+
+    def read(self, columns: list[str] | None = None, start: datetime | None = None, end: datetime | None = None,
+             version: int | None = None) -> DataFrame | None:
+        """None when the file does not mirror the version of the store, the caller falls back on the store."""
+        layout: dict[str, Any] | None = self.read_layout()
+        if layout is None or (version is not None and layout['version'] != version):
+            log.info(f'{self.path} is not at version {version}: {layout['version'] if layout else None}')
+            return None
+
+        times: np.ndarray = self.__memmap(layout, 'time')
+        first: int = int(np.searchsorted(times, np.datetime64(start, 'ns').astype(np.int64))) if start else 0
+        last: int = int(np.searchsorted(times, np.datetime64(end, 'ns').astype(np.int64), 'right')) if end else len(
+            times)
+        data: dict[str, Any] = {'time': times[first:last].view('datetime64[ns]')}
+        for col in (columns if columns is not None else layout['columns'].keys()):
+            if col == 'time':
+                continue
+            if col not in layout['columns']:
+                data[col] = np.full(last - first, np.nan)
+            elif layout['columns'][col]['storage'] == 'int16':
+                values: np.ndarray = self.__memmap(layout, col)[first:last]
+                if layout['columns'][col]['dtype'] == 'int64':
+                    data[col] = values.astype('int64')
+                else:
+                    data[col] = pd.Series(values).astype('Int64').mask(values == INT16_MISSING)
+            else:
+                data[col] = self.__memmap(layout, col)[first:last].astype('float64')
+        log.info(f'{self.path}: {last - first} rows of {len(times)} mapped, version {layout['version']}')
+        return pd.DataFrame(data)
+
+    def rebuild(self, df: DataFrame, version: int) -> None:
+        old: dict[str, Any] | None = self.read_layout()
+        layout: dict[str, Any] = {'rows': len(df), 'generation': old['generation'] + 1 if old else 1,
+                                  'version': version, 'columns': {}, 'garbage': {}}
+        df = df.sort_values(by='time').reset_index(drop=True)
+        for col in df.columns:
+            storage: str | None = self.__storage(df[col]) if col != 'time' else 'int64'
+            if storage is not None:
+                layout['columns'][col] = {'storage': storage, 'dtype': str(df[col].dtype)}
+        os.makedirs(self.path, exist_ok=True)
+        for col in layout['columns']:
+            self.__write_file(self.__file(layout, col), self.__values(layout, df, col))
+        self.__publish(layout, old)
+        log.info(f'{self.path} rebuilt: {len(df)} rows, {len(layout['columns'])} columns, version {version}')
+
+    def upsert(self, df: DataFrame, version: int) -> bool:
+        """Writes the rows of df, False when only a rebuild can."""
+        layout: dict[str, Any] | None = self.read_layout()
+        if layout is None or not all(col in layout['columns'] for col in df.columns if self.__storage(df[col])):
+            return False
+        df = df.drop_duplicates(subset='time', keep='last').sort_values(by='time').reset_index(drop=True)
+        times: np.ndarray = self.__memmap(layout, 'time')
+        keys: np.ndarray = df['time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        positions: np.ndarray = np.searchsorted(times, keys)
+        known: np.ndarray = (positions < len(times)) & (
+            times[np.minimum(positions, len(times) - 1)] == keys if len(times) > 0 else False)
+        new: np.ndarray = ~known
+        if new.any() and len(times) > 0 and keys[new].min() <= times[-1]:
+            return False
+
+        old: dict[str, Any] = layout
+        if known.any():
+            layout = self.__copy(old)
+        for col in [col for col in df.columns if col in layout['columns'] and col != 'time']:
+            values: np.ndarray = self.__values(layout, df, col)
+            if known.any():
+                mapped: np.ndarray = np.memmap(self.__file(layout, col), mode='r+', dtype=values.dtype,
+                                               shape=(layout['rows'],))
+                present: np.ndarray = known & df[col].notna().to_numpy()
+                mapped[positions[present]] = values[present]
+                mapped.flush()
+                del mapped
+        if new.any():
+            for col in layout['columns']:
+                values = self.__values(layout, df[new].reindex(columns=df.columns.union([col])), col)
+                with open(self.__file(layout, col), 'ab') as file:
+                    file.write(values.tobytes())
+                    file.flush()
+                    os.fsync(file.fileno())
+        layout['rows'] += int(new.sum())
+        layout['version'] = version
+        self.__publish(layout, old)
+        log.info(f'{self.path}: {int(known.sum())} rows written, {int(new.sum())} appended, version {version}')
+        return True
+
+    @staticmethod
+    def __storage(series: pd.Series) -> str | None:
+        if pd.api.types.is_integer_dtype(series):
+            return 'int16'
+        if pd.api.types.is_float_dtype(series):
+            return 'float32'
+        return None
+
+    def __values(self, layout: dict[str, Any], df: DataFrame, col: str) -> np.ndarray:
+        storage: str = layout['columns'][col]['storage']
+        if storage == 'int64':
+            return df[col].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        if storage == 'int16':
+            return df[col].astype('float64').fillna(INT16_MISSING).clip(INT16_MISSING, np.iinfo(np.int16).max) \
+                .to_numpy(dtype=np.int16)
+        return df[col].astype('float64').to_numpy(dtype=np.float32)
+
+    def __memmap(self, layout: dict[str, Any], col: str) -> np.ndarray:
+        dtype: str = layout['columns'][col]['storage']
+        if layout['rows'] == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.__file(layout, col), mode='r', dtype=dtype, shape=(layout['rows'],))
+
+    def __file(self, layout: dict[str, Any], col: str) -> str:
+        return f'{self.path}/{layout['generation']:06d}_{col}.bin'
+
+    def __copy(self, old: dict[str, Any]) -> dict[str, Any]:
+        """The layout of a new generation with the rows of old, its files written but not published yet."""
+        layout: dict[str, Any] = dict(old, generation=old['generation'] + 1, garbage={})
+        for col in layout['columns']:
+            self.__write_file(self.__file(layout, col), np.array(self.__memmap(old, col)))
+        return layout
+
+    def __publish(self, layout: dict[str, Any], old: dict[str, Any] | None) -> None:
+        """Writes layout. A graph may still map a previous generation: its files are removed GARBAGE_SECONDS after
+        the layout that left them, the layout records since when."""
+        layout.setdefault('garbage', {})
+        for file in glob.glob(f'{self.path}/*.bin'):
+            name: str = os.path.basename(file)
+            if not name.startswith(f'{layout['generation']:06d}_'):
+                layout['garbage'][name] = (old.get('garbage', {}) if old else {}).get(name, time.time())
+        self.__write_layout(layout)
+
+        for name, since in layout['garbage'].items():
+            if time.time() - since > GARBAGE_SECONDS:
+                try:
+                    os.remove(f'{self.path}/{name}')
+                except OSError as ex:
+                    log.warning(f'{self.path}/{name} not removed, still mapped by a graph? {ex}')
+
+    @staticmethod
+    def __write_file(file: str, values: np.ndarray) -> None:
+        with open(file, 'wb') as binary_file:
+            binary_file.write(values.tobytes())
+            binary_file.flush()
+            os.fsync(binary_file.fileno())
+
+    def __write_layout(self, layout: dict[str, Any]) -> None:
+        HistoryStore.publish(self.layout_file, json.dumps(layout, indent=4))
@@ -0,0 +1,54 @@
+import threading
+from datetime import datetime
+
+import pandas as pd
+from pandas import DataFrame
+
+import thermopro
+from thermopro import log
+from thermopro.HistoryStore import HistoryStore
+
+
+# The whole history kept in memory and shared by the scan, the graphs and the tooltip of the same process.
+# It is tagged with the manifest version of the store it was read from: the store is read again only when its
+# version changed behind our back (compaction, full rewrite), the rows appended by this process are merged in memory.
+class Dataset:
+
+    def __init__(self, store: HistoryStore | None = None):
+        self.store: HistoryStore = store if store is not None else HistoryStore()
+        self.df: DataFrame | None = None
+        self.version: int | None = None
+        self.lock: threading.RLock = threading.RLock()
+
+    def get(self, columns: list[str] | None = None, start: datetime | None = None,
+            end: datetime | None = None) -> DataFrame:
+        with self.lock:
+            version: int = self.store.read_manifest()['version']
+            if self.df is None or version != self.version:
+                log.info(f'Dataset version {self.version} -> {version}, reading the store')
+                self.df = thermopro.query()
+                # The first query may have migrated the legacy file, which bumps the version
+                self.version = self.store.read_manifest()['version']
+            df: DataFrame = self.df
+            if start is not None:
+                df = df[df['time'] >= start]
+            if end is not None:
+                df = df[df['time'] <= end]
+            if columns is not None:
+                df = df[['time'] + [col for col in columns if col != 'time']]
+            return df.reset_index(drop=True).copy()
+
+    def apply(self, df: DataFrame, from_version: int, to_version: int) -> None:
+        with self.lock:
+            if self.df is None:
+                return
+            if self.version != from_version:
+                log.info(f'Dataset version {self.version} is not {from_version}, it will be read again')
+                self.df = None
+                return
+            # The rows of upsert() only hold the changed column, the other ones are kept
+            merged: DataFrame = pd.concat([self.df, thermopro.set_astype(df.copy())], ignore_index=True)
+            merged = self.store.coalesce(merged).astype(self.df.dtypes.to_dict())
+            self.df = merged.sort_values(by='time', ascending=True).reset_index(drop=True)
+            self.version = to_version
+            log.info(f'Dataset version {to_version}: {len(df)} rows applied, {len(self.df)} rows')
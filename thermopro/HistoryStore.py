@@ -0,0 +1,442 @@
+import glob
+import io
+import json
+import os
+import threading
+import time
+import zipfile
+from collections.abc import Iterable
+from datetime import datetime
+from typing import Any
+
+import pandas as pd
+from pandas import DataFrame
+
+from thermopro import log
+from thermopro.Codec import Codec
+from thermopro.ColumnEncoding import ColumnEncoding
+from thermopro.constants import THERMO_PRO_SCAN_STORE_PATH, SEGMENT_ROWS, SEGMENT_FORMAT
+
+MANIFEST_FILE = 'manifest.json'
+ACTIVE_FILE = 'active.jsonl'
+# The files no manifest points to anymore are removed this long after the first manifest without them, a reader of a
+# previous manifest may still be reading them
+GARBAGE_SECONDS: int = 60 * 60
+
+
+# Layout of a store folder:
+#   manifest_00000042.json -> version 42 of the list of sealed segments (name, month, rows, first and last time,
+#                             columns), of the active log state (file and committed length) and of the catalog of
+#                             the columns (schema: the time and version each column showed up)
+#   2025-01_000001.zip     -> sealed segment of one month, one zip member per column, written once and never rewritten,
+#                             'columns' format: {col}.json, 'encoded' format: {col}.bin, see ColumnEncoding,
+#                             each member compressed by the codec of the segment and stored as is in the zip
+#   active_000003.jsonl    -> one JSON record per line, new rows are appended here until the month is over
+# Every write is published by a new manifest: written in a .tmp file, fsync, renamed. A reader opens the latest
+# manifest and only reads what it points to, up to the committed length of the active log: it never sees a half
+# written file, without lock, and a writer never waits on it. A sealed active log or a rewritten segment is left on
+# disk for the readers of the previous manifests: the manifest records since when (garbage), it is removed
+# GARBAGE_SECONDS later.
+# A segment never holds more than one month, so a range query only opens the months it overlaps, and only the
+# members of the requested columns are decompressed.
+# When the same key is found more than once, the last value written wins, column by column: upsert() only appends
+# the cells it changes.
+# compact() thins the old sealed segments, see RETENTION_POLICIES.
+# A new column costs nothing to the history: it goes in the catalog and in the segments written from then on, load()
+# gives null for the rows of the segments without it.
+class HistoryStore:
+    # The compaction runs in its own thread while the scan keeps appending
+    lock: threading.RLock = threading.RLock()
+
+    def __init__(self, path: str = THERMO_PRO_SCAN_STORE_PATH, keys: list[str] | None = None,
+                 segment_format: str = SEGMENT_FORMAT, codec: Codec | None = None):
+        self.path: str = path
+        self.keys: list[str] = keys if keys else ['time']
+        self.segment_format: str = segment_format
+        self.codec: Codec = codec if codec is not None else Codec.for_use('segment')
+        # Before the versioned manifests
+        self.manifest_file: str = f'{path}/{MANIFEST_FILE}'
+
+    def exists(self) -> bool:
+        return len(self.__manifests()) > 0 or os.path.isfile(self.manifest_file)
+
+    def read_manifest(self) -> dict[str, Any]:
+        manifests: list[str] = self.__manifests()
+        if len(manifests) > 0:
+            with open(manifests[-1], 'r') as file:
+                manifest: dict[str, Any] = json.load(file)
+        elif os.path.isfile(self.manifest_file):
+            with open(self.manifest_file, 'r') as file:
+                manifest = json.load(file)
+        else:
+            manifest = {'version': 0, 'next_segment': 1, 'active_rows': 0, 'active_partition': None, 'segments': []}
+        manifest.setdefault('active_file', ACTIVE_FILE)
+        manifest.setdefault('active_bytes', None)
+        manifest.setdefault('active_generation', 0)
+        if 'schema' not in manifest:
+            # Before the catalog: the columns of the segments, the active log adds its own at the next append
+            manifest['schema'] = {}
+            for segment in manifest['segments']:
+                for col in segment['columns']:
+                    manifest['schema'].setdefault(col, {'since': segment['start'], 'version': None})
+        return manifest
+
+    def columns(self) -> list[str]:
+        return list(self.read_manifest()['schema'].keys())
+
+    @staticmethod
+    def publish(file: str, text: str) -> None:
+        """Replaces file by text at once, even after a crash: .tmp file, fsync, rename."""
+        with open(file + '.tmp', 'w', encoding='utf-8') as tmp_file:
+            tmp_file.write(text)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        for retry in range(50):
+            try:
+                os.replace(file + '.tmp', file)
+                return
+            except PermissionError:
+                # Windows refuses to replace a file another process is reading, for the few ms it takes
+                time.sleep(0.01)
+        os.replace(file + '.tmp', file)
+
+    def load(self, start: datetime | None = None, end: datetime | None = None,
+             columns: list[str] | None = None) -> DataFrame | None:
+        manifest: dict[str, Any] = self.read_manifest()
+        if columns is not None:
+            columns = self.keys + [col for col in columns if col not in self.keys]
+        segments: list[dict[str, Any]] = [segment for segment in manifest['segments'] if
+                                          self.__overlaps(segment, start, end)]
+        log.info(f'Loading {len(segments)}/{len(manifest['segments'])} segments, from: {start}, to: {end}')
+
+        frames: list[DataFrame] = [self.__read_segment(segment, columns) for segment in segments]
+        frames.append(self.__read_active(manifest))
+        frames = [frame for frame in frames if frame is not None and len(frame) > 0]
+        if len(frames) == 0:
+            return None
+
+        df: DataFrame = pd.concat(frames, ignore_index=True)
+        if columns is not None:
+            df = df.reindex(columns=columns)
+        else:
+            # The columns added after the segments read are null
+            df = df.reindex(columns=list(df.columns) + [col for col in manifest['schema'] if col not in df.columns])
+        # The ISO strings of the JSON files and the datetime64 of the encoded segments must compare equal
+        df['time'] = pd.to_datetime(df['time']).astype('datetime64[ns]')
+        df = self.coalesce(df)
+        if start is not None:
+            df = df[df['time'] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df['time'] <= pd.Timestamp(end)]
+        return df.sort_values(by=self.keys, ascending=True).reset_index(drop=True)
+
+    def append(self, df: DataFrame) -> None:
+        if df is None or len(df) == 0:
+            return
+        with HistoryStore.lock:
+            self.__append(df)
+
+    def __append(self, df: DataFrame, manifest: dict[str, Any] | None = None) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        manifest = manifest if manifest is not None else self.read_manifest()
+
+        partition: str = self.__partitions(df).max()
+        if manifest['active_partition'] is not None and partition > manifest['active_partition']:
+            self.__seal(manifest)
+
+        self.__catalog(manifest, list(df.columns), pd.to_datetime(df['time']).min().isoformat())
+        lines: str = df.to_json(orient='records', lines=True, date_format='iso')
+        active_file: str = f'{self.path}/{manifest['active_file']}'
+        with open(active_file, 'r+b' if os.path.exists(active_file) else 'wb') as file:
+            # What a crashed append wrote after the committed length is dropped
+            committed: int = manifest['active_bytes'] if manifest['active_bytes'] is not None else file.seek(0, 2)
+            if os.path.getsize(active_file) > committed:
+                file.truncate(committed)
+            file.seek(committed)
+            file.write((lines if lines.endswith('\n') else lines + '\n').encode('utf-8'))
+            file.flush()
+            os.fsync(file.fileno())
+            manifest['active_bytes'] = file.tell()
+        manifest['active_rows'] += len(df)
+        manifest['active_partition'] = max(partition, manifest['active_partition'] or partition)
+        log.info(f'Appended {len(df)} rows to {active_file}, active rows: {manifest['active_rows']}')
+
+        if manifest['active_rows'] >= SEGMENT_ROWS:
+            self.__seal(manifest)
+        self.__write_manifest(manifest)
+
+    def upsert(self, column: str, values: pd.Series, freq: str = 'h') -> DataFrame:
+        """Sets column to values, indexed by the time floored to freq, on the stored rows of those periods.
+        Only the cells that differ are appended, as (keys, column) rows, and returned."""
+        if values is None or len(values) == 0:
+            return pd.DataFrame(columns=self.keys + [column])
+        with HistoryStore.lock:
+            end: pd.Timestamp = values.index.max() + pd.tseries.frequencies.to_offset(freq) - pd.Timedelta(seconds=1)
+            df: DataFrame | None = self.load(start=values.index.min(), end=end, columns=[column])
+            if df is None:
+                return pd.DataFrame(columns=self.keys + [column])
+            new: pd.Series = pd.to_datetime(df['time']).dt.floor(freq).map(values)
+            changed: pd.Series = new.notna() & (df[column].isna() | (df[column] != new))
+            df = df.loc[changed, self.keys].assign(**{column: new[changed]}).reset_index(drop=True)
+            log.info(f'Upsert {column}: {len(values)} values, {len(df)} cells changed')
+            if len(df) > 0:
+                self.__append(df)
+            return df
+
+    def coalesce(self, df: DataFrame) -> DataFrame:
+        duplicated: pd.Series = df.duplicated(subset=self.keys, keep=False)
+        if not duplicated.any():
+            return df
+        # groupby().last() keeps the last non null value of every column
+        coalesced: DataFrame = df[duplicated].groupby(self.keys, sort=False).last().reset_index()
+        return pd.concat([df[~duplicated], coalesced], ignore_index=True)[df.columns]
+
+    def write(self, df: DataFrame | Iterable[DataFrame]) -> None:
+        """Full rewrite of the store, only used to migrate the whole history.
+        df may be chunks sorted by time (JsonRecordsReader.chunks()): a month is written as soon as the next one starts."""
+        with HistoryStore.lock:
+            self.__write([df] if isinstance(df, DataFrame) else df)
+
+    def __write(self, chunks: Iterable[DataFrame]) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        old_manifest: dict[str, Any] = self.read_manifest()
+        old_segments: list[dict[str, Any]] = old_manifest['segments']
+        manifest: dict[str, Any] = {'version': old_manifest['version'], 'next_segment': old_manifest['next_segment'],
+                                    'active_rows': 0, 'active_partition': None, 'segments': [],
+                                    'compacted_until': old_manifest.get('compacted_until'),
+                                    'active_generation': old_manifest['active_generation'],
+                                    'schema': old_manifest['schema']}
+        samples: dict[str, int] = {segment['partition']: segment['samples_per_day'] for segment in old_segments if
+                                   'samples_per_day' in segment}
+
+        rows: int = 0
+        df: DataFrame | None = None
+        for chunk in chunks:
+            if len(chunk) == 0:
+                continue
+            rows += len(chunk)
+            self.__catalog(manifest, list(chunk.columns), pd.to_datetime(chunk['time']).min().isoformat())
+            df = chunk if df is None else pd.concat([df, chunk], ignore_index=True)
+            df = df.sort_values(by=self.keys, ascending=True).reset_index(drop=True)
+            partitions: pd.Series = self.__partitions(df)
+            latest: str = partitions.max()
+            for partition, df_partition in df[partitions < latest].groupby(partitions[partitions < latest], sort=True):
+                self.__write_segment(manifest, df_partition, str(partition))
+                if str(partition) in samples:
+                    manifest['segments'][-1]['samples_per_day'] = samples[str(partition)]
+            # The latest month may go on in the next chunk
+            df = df[partitions == latest]
+
+        self.__new_active(manifest)
+        if df is not None:
+            self.__append(df, manifest)
+        else:
+            self.__write_manifest(manifest)
+        log.info(f'Store {self.path} rewritten: {rows} rows in {len(manifest['segments'])} segments')
+
+    def compact(self, policies: list[tuple[int, int]], now: datetime | None = None) -> dict[str, int]:
+        """Thins the sealed months older than each policy age to that many samples per day, the latest policies win.
+        pending_bytes: freed once the replaced segments are removed, GARBAGE_SECONDS later."""
+        now = now if now is not None else datetime.now()
+        result: dict[str, int] = {'segments': 0, 'rows': 0, 'pending_bytes': 0}
+        manifest: dict[str, Any] = self.read_manifest()
+        partitions: dict[str, list[dict[str, Any]]] = {}
+        for segment in manifest['segments']:
+            partitions.setdefault(segment['partition'], []).append(segment)
+
+        for partition, segments in sorted(partitions.items()):
+            samples: int = self.__samples_per_day(policies, segments, now)
+            if all(segment.get('samples_per_day', 24) <= samples for segment in segments):
+                continue
+            df: DataFrame = self.load(start=pd.Timestamp(min(segment['start'] for segment in segments)),
+                                      end=pd.Timestamp(max(segment['end'] for segment in segments)))
+            # Not the columns added since, which are null here
+            df = df[[col for col in df.columns if any(col in segment['columns'] for segment in segments)]]
+            df = df[self.__partitions(df) == partition]
+            slots: pd.Series = pd.to_datetime(df['time']).dt.floor(f'{24 // samples}h')
+            df = df[~pd.concat([slots, df[self.keys[1:]]], axis=1).duplicated(keep='first')]
+            before: int = sum(segment['rows'] for segment in segments)
+            size: int = sum(os.path.getsize(f'{self.path}/{segment['name']}') for segment in segments)
+
+            with HistoryStore.lock:
+                manifest = self.read_manifest()
+                names: list[str] = [segment['name'] for segment in segments]
+                if not all(name in [segment['name'] for segment in manifest['segments']] for name in names):
+                    log.warning(f'Partition {partition} changed while compacting, skipped')
+                    continue
+                manifest['segments'] = [segment for segment in manifest['segments'] if segment['name'] not in names]
+                self.__write_segment(manifest, df, partition)
+                compacted: dict[str, Any] = manifest['segments'][-1]
+                compacted['samples_per_day'] = samples
+                manifest['segments'] = sorted(manifest['segments'], key=lambda segment: segment['start'])
+                manifest['compacted_until'] = max(manifest.get('compacted_until') or compacted['end'],
+                                                  compacted['end'])
+                self.__write_manifest(manifest)
+
+            result['segments'] += len(segments)
+            result['rows'] += before - len(df)
+            result['pending_bytes'] += size - os.path.getsize(f'{self.path}/{compacted['name']}')
+            log.info(f'Partition {partition} compacted to {samples} samples per day: {len(segments)} segments, '
+                     f'{before} -> {len(df)} rows')
+        log.info(f'Store {self.path} compacted: {result['segments']} segments, {result['rows']} rows and '
+                 f'{result['pending_bytes']} bytes to reclaim in {GARBAGE_SECONDS} s')
+        return result
+
+    def files(self) -> list[str]:
+        """Files of the latest version of the store, and the other files of its folder (rollups...)."""
+        manifest: dict[str, Any] = self.read_manifest()
+        live: list[str] = self.__live(manifest)
+        return sorted([file.replace('\\', '/') for file in glob.glob(f'{self.path}/*') if
+                       os.path.basename(file) in live or not self.__is_store_file(os.path.basename(file))])
+
+    def __seal(self, manifest: dict[str, Any]) -> None:
+        df: DataFrame | None = self.__read_active(manifest)
+        if df is not None and len(df) > 0:
+            partitions: pd.Series = self.__partitions(df)
+            for partition, df_partition in df.groupby(partitions, sort=True):
+                self.__write_segment(manifest, df_partition, str(partition))
+        self.__new_active(manifest)
+        manifest['active_partition'] = None
+
+    @staticmethod
+    def __catalog(manifest: dict[str, Any], columns: list[str], since: str) -> None:
+        for col in columns:
+            if col not in manifest['schema']:
+                manifest['schema'][col] = {'since': since, 'version': manifest['version'] + 1}
+                log.info(f'New column {col} since {since}, version {manifest['version'] + 1}')
+
+    @staticmethod
+    def __new_active(manifest: dict[str, Any]) -> None:
+        # The readers of the previous manifests keep reading the previous file
+        manifest['active_generation'] += 1
+        manifest['active_file'] = f'active_{manifest['active_generation']:06d}.jsonl'
+        manifest['active_bytes'] = 0
+        manifest['active_rows'] = 0
+
+    def __write_segment(self, manifest: dict[str, Any], df: DataFrame, partition: str) -> None:
+        name: str = f'{partition}_{manifest['next_segment']:06d}.zip'
+        times: pd.Series = pd.to_datetime(df['time']).astype('datetime64[ns]')
+        encodings: dict[str, str] = {}
+        with open(f'{self.path}/{name}', 'wb') as file, zipfile.ZipFile(file, 'w', zipfile.ZIP_STORED) as zip_file:
+            for col in df.columns:
+                if self.segment_format == 'encoded':
+                    series: pd.Series = times if col == 'time' else df[col]
+                    encodings[col] = ColumnEncoding.kind(series)
+                    zip_file.writestr(f'{col}.bin', self.codec.compress(ColumnEncoding.encode(series, encodings[col])))
+                else:
+                    zip_file.writestr(f'{col}.json', self.codec.compress(
+                        df[col].to_json(orient='values', date_format='iso').encode('utf-8')))
+            zip_file.close()
+            file.flush()
+            os.fsync(file.fileno())
+        segment: dict[str, Any] = {
+            'name': name,
+            'format': self.segment_format,
+            'codec': self.codec.name,
+            'partition': partition,
+            'rows': len(df),
+            'start': times.min().isoformat(),
+            'end': times.max().isoformat(),
+            'columns': list(df.columns)
+        }
+        if self.segment_format == 'encoded':
+            segment['encodings'] = encodings
+        manifest['segments'].append(segment)
+        manifest['next_segment'] += 1
+        log.info(f'Segment {name} sealed: {len(df)} rows, from: {times.min()}, to: {times.max()}')
+
+    def __write_manifest(self, manifest: dict[str, Any]) -> None:
+        manifest['version'] += 1
+        self.__mark_garbage(manifest)
+        # A new file for every version: never replaces a manifest a reader has open
+        self.publish(f'{self.path}/manifest_{manifest['version']:08d}.json', json.dumps(manifest, indent=4))
+        self.__collect_garbage(manifest)
+
+    def __manifests(self) -> list[str]:
+        return sorted(glob.glob(f'{self.path}/manifest_*.json'))
+
+    def __live(self, manifest: dict[str, Any]) -> list[str]:
+        name: str = f'manifest_{manifest['version']:08d}.json' if self.__manifests() else MANIFEST_FILE
+        return [name, manifest['active_file']] + [segment['name'] for segment in manifest['segments']]
+
+    @staticmethod
+    def __is_store_file(name: str) -> bool:
+        return (name.endswith('.zip') or name.endswith('.tmp') or name == MANIFEST_FILE or
+                (name.startswith('manifest_') and name.endswith('.json')) or
+                (name.startswith('active') and name.endswith('.jsonl')))
+
+    def __mark_garbage(self, manifest: dict[str, Any]) -> None:
+        # Since when the files on disk are not in manifest: its previous version, a sealed log, replaced segments
+        live: list[str] = self.__live(manifest)
+        garbage: dict[str, float] = manifest.get('garbage') or {}
+        manifest['garbage'] = {}
+        for file in glob.glob(f'{self.path}/*'):
+            name: str = os.path.basename(file)
+            if name not in live and self.__is_store_file(name) and not name.endswith('.tmp'):
+                manifest['garbage'][name] = garbage.get(name, time.time())
+
+    def __collect_garbage(self, manifest: dict[str, Any]) -> None:
+        for name, since in manifest['garbage'].items():
+            file: str = f'{self.path}/{name}'
+            try:
+                if time.time() - since > GARBAGE_SECONDS and os.path.exists(file):
+                    os.remove(file)
+                    log.info(f'{file} removed, no manifest points to it since {datetime.fromtimestamp(since)}')
+            except OSError as ex:
+                log.warning(f'{file} not removed, still open? {ex}')
+        # Left by a crash while publishing, nobody reads them
+        for file in glob.glob(f'{self.path}/*.tmp'):
+            try:
+                if time.time() - os.path.getmtime(file) > GARBAGE_SECONDS:
+                    os.remove(file)
+                    log.info(f'{file} removed')
+            except OSError as ex:
+                log.warning(f'{file} not removed, still open? {ex}')
+
+    def __read_segment(self, segment: dict[str, Any], columns: list[str] | None) -> DataFrame:
+        if segment.get('format') not in ['columns', 'encoded']:
+            df: DataFrame = pd.read_json(f'{self.path}/{segment['name']}', compression='zip', orient='records',
+                                         convert_dates=False)
+            return df if columns is None else df[[col for col in columns if col in df.columns]]
+
+        # The first segments were compressed by zipfile itself (LZMA), without codec
+        codec: Codec = Codec(segment.get('codec', 'stored'))
+        with zipfile.ZipFile(f'{self.path}/{segment['name']}', 'r') as zip_file:
+            if segment['format'] == 'encoded':
+                return pd.DataFrame({
+                    col: ColumnEncoding.decode(codec.decompress(zip_file.read(f'{col}.bin')), segment['encodings'][col])
+                    for col in (columns if columns is not None else segment['columns']) if col in segment['columns']
+                })
+            return pd.DataFrame({
+                col: json.loads(codec.decompress(zip_file.read(f'{col}.json')))
+                for col in (columns if columns is not None else segment['columns']) if col in segment['columns']
+            })
+
+    def __read_active(self, manifest: dict[str, Any]) -> DataFrame | None:
+        active_file: str = f'{self.path}/{manifest['active_file']}'
+        if not os.path.exists(active_file) or manifest['active_bytes'] == 0:
+            return None
+        with open(active_file, 'rb') as file:
+            # Only the committed length, the scanner may be appending the next lines
+            data: bytes = file.read(manifest['active_bytes']) if manifest['active_bytes'] is not None else file.read()
+        if len(data.strip()) == 0:
+            return None
+        return pd.read_json(io.BytesIO(data), orient='records', lines=True, convert_dates=False, precise_float=True)
+
+    @staticmethod
+    def __samples_per_day(policies: list[tuple[int, int]], segments: list[dict[str, Any]], now: datetime) -> int:
+        end: pd.Timestamp = max(pd.Timestamp(segment['end']) for segment in segments)
+        samples: int = 24
+        for days, samples_per_day in sorted(policies):
+            if end < pd.Timestamp(now) - pd.Timedelta(days=days):
+                samples = min(samples, samples_per_day)
+        return samples
+
+    @staticmethod
+    def __partitions(df: DataFrame) -> pd.Series:
+        return pd.to_datetime(df['time']).dt.strftime('%Y-%m')
+
+    @staticmethod
+    def __overlaps(segment: dict[str, Any], start: datetime | None, end: datetime | None) -> bool:
+        return ((start is None or pd.Timestamp(segment['end']) >= pd.Timestamp(start)) and
+                (end is None or pd.Timestamp(segment['start']) <= pd.Timestamp(end)))
@@ -18,11 +18,14 @@ from pandas.io.parsers import TextFileReader
 import thermopro
 from constants import HYDRO_EMAIL, HYDRO_PASSWORD
 from thermopro import log
+from thermopro.Source import Source
 
 
-class HydroQuébec:
+class HydroQuébec(Source):
+    name: str = 'hydro_quebec'
 
     def __init__(self):
+        super().__init__()
         log.info(' Starting HydroQuébec '.center(100, '*'))
 
     async def __get_kwh_list(self,
@@ -104,6 +107,11 @@ class HydroQuébec:
             result_queue.put({'kwh_dict': kwh_dict})
         log.info(' End get_kwh_list '.center(100, '*'))
 
+    async def collect(self) -> dict[str, dict[str, float]]:
+        result_queue: Queue = Queue()
+        await self.__get_kwh_list(result_queue)
+        return result_queue.get()
+
     def start(self, result_queue: Queue):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
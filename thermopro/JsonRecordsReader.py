@@ -0,0 +1,102 @@
+import io
+import json
+import zipfile
+from collections.abc import Iterator
+from typing import Any, TextIO
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from thermopro import log
+
+BLOCK_SIZE: int = 1024 * 1024
+CHUNK_ROWS: int = 24 * 31
+
+
+# Reads a JSON array of records, as save_json wrote it (orient='records', plain or zipped), a chunk of rows at a time.
+# pandas.read_json builds the Python objects of the whole file before the DataFrame, here a record is decoded and
+# copied in the numpy buffers of its chunk right away: the memory stays one block of text plus one chunk.
+# dtypes: SCHEMA like, the columns not in it are float64. An int64 column is read as float64 (missing values), set_astype
+# rounds it, a str column stays object.
+class JsonRecordsReader:
+
+    def __init__(self, file: str, dtypes: dict[str, str] | None = None, chunk_rows: int = CHUNK_ROWS):
+        self.file: str = file
+        self.dtypes: dict[str, str] = dtypes if dtypes is not None else {}
+        self.chunk_rows: int = chunk_rows
+
+    def chunks(self) -> Iterator[DataFrame]:
+        buffers: dict[str, np.ndarray] = {}
+        rows: int = 0
+        total: int = 0
+        for record in self.records():
+            for col, value in record.items():
+                if col not in buffers:
+                    buffers[col] = self.__buffer(col)
+                buffers[col][rows] = np.nan if value is None and buffers[col].dtype.kind == 'f' else value
+            rows += 1
+            if rows == self.chunk_rows:
+                yield self.__frame(buffers, rows)
+                total += rows
+                buffers, rows = {}, 0
+        if rows > 0:
+            yield self.__frame(buffers, rows)
+            total += rows
+        log.info(f'{self.file}: {total} records read by chunks of {self.chunk_rows}')
+
+    def read(self) -> DataFrame:
+        return pd.concat(list(self.chunks()), ignore_index=True)
+
+    def records(self) -> Iterator[dict[str, Any]]:
+        decoder: json.JSONDecoder = json.JSONDecoder()
+        with self.__open() as text:
+            buffer: str = ''
+            position: int = 0
+            eof: bool = False
+            while True:
+                # Separators between the records: [ , ] and white spaces
+                while position < len(buffer) and buffer[position] in '[,] \t\r\n':
+                    position += 1
+                if position == len(buffer) or buffer[position] == '{':
+                    try:
+                        if position == len(buffer):
+                            raise ValueError('End of buffer')
+                        record, position = decoder.raw_decode(buffer, position)
+                        yield record
+                        continue
+                    except ValueError:
+                        if eof:
+                            if position < len(buffer):
+                                raise
+                            return
+                    block: str = text.read(BLOCK_SIZE)
+                    eof = len(block) == 0
+                    buffer, position = buffer[position:] + block, 0
+                else:
+                    raise ValueError(f'{self.file}: unexpected {buffer[position:position + 20]!r}')
+
+    def __open(self) -> TextIO:
+        if zipfile.is_zipfile(self.file):
+            zip_file: zipfile.ZipFile = zipfile.ZipFile(self.file)
+            return io.TextIOWrapper(zip_file.open(zip_file.namelist()[0]), encoding='utf-8')
+        return open(self.file, 'r', encoding='utf-8')
+
+    def __buffer(self, col: str) -> np.ndarray:
+        dtype: str = self.dtypes.get(col, 'float64')
+        if dtype == 'float64':
+            return np.full(self.chunk_rows, np.nan)
+        # Converted with their column once the chunk is full: an int64 may be missing, a date is a string
+        return np.full(self.chunk_rows, None, dtype=object)
+
+    def __frame(self, buffers: dict[str, np.ndarray], rows: int) -> DataFrame:
+        df: DataFrame = pd.DataFrame({col: buffer[:rows] for col, buffer in buffers.items()})
+        for col in df.columns:
+            dtype: str = self.dtypes.get(col, 'float64')
+            if dtype == 'datetime64[ns]':
+                # ISO strings, or epoch in ms: the default date_format of to_json
+                numeric: bool = pd.api.types.is_number(df[col].dropna().iloc[0]) if df[col].notna().any() else False
+                df[col] = pd.to_datetime(df[col], unit='ms' if numeric else None).astype('datetime64[ns]')
+            elif dtype == 'int64':
+                df[col] = pd.to_numeric(df[col]).astype('float64')
+        return df
@@ -9,6 +9,7 @@ from requests import Response
 import thermopro
 from constants import NEVIWEB_EMAIL, NEVIWEB_PASSWORD
 from thermopro import log
+from thermopro.Source import Source
 
 REQUESTS_TIMEOUT = 30
 HOST = "https://neviweb.com"
@@ -311,7 +312,8 @@ ALL_ATTRIBUTES = [ATTR_ALERT, ATTR_SIGNATURE, ATTR_POWER_MODE, ATTR_MODE, ATTR_O
                   ATTR_AUX_HEAT_MIN_TIMEOFF, ATTR_HEAT_MIN_TIME_ON, ATTR_HEAT_MIN_TIME_OFF]
 
 
-class NeviwebTemperature:
+class NeviwebTemperature(Source):
+    name: str = 'neviweb'
 
     def __init__(
             self,
@@ -324,6 +326,7 @@ class NeviwebTemperature:
             ignore_miwi=None,
             timeout=REQUESTS_TIMEOUT
     ):
+        super().__init__()
         log.info(' Starting NeviwebTemperature '.center(100, '*'))
         self.hass = hass
         self._email = username
@@ -710,6 +713,9 @@ class NeviwebTemperature:
             except OSError as ex:
                 raise ex
 
+    async def collect(self) -> dict[str, int | float | None]:
+        return await self.in_thread(self.load_neviweb)
+
     def load_neviweb(self, result_queue: Queue):
         log.info(' Start load_neviweb '.center(100, '*'))
         result: dict[str, int | float | None] = {}
@@ -4,16 +4,20 @@ from datetime import datetime
 from queue import Queue
 from typing import Any
 
+import aiohttp
 import requests
 
 import thermopro
 from constants import WEATHER_URL, NEVIWEB_EMAIL, NEVIWEB_PASSWORD
 from thermopro import log
+from thermopro.Source import Source
 
 
-class OpenWeather:
+class OpenWeather(Source):
+    name: str = 'open_weather'
 
     def __init__(self):
+        super().__init__()
         log.info(' Start OpenWeather '.center(100, '*'))
 
     # https://home.openweathermap.org/statistics/onecall_30
@@ -21,43 +25,52 @@ class OpenWeather:
         log.info(' Start load_open_weather '.center(100, '*'))
         try:
             response = requests.get(WEATHER_URL)
-            resp = response.json()
-
-            log.info(json.dumps(resp, indent=4, sort_keys=True))
-
-            if "cod" in resp:
-                log.error(json.dumps(resp, indent=4, sort_keys=True))
-            elif "current" in resp:
-                current = resp['current']
-                data: dict[str, Any] = {
-                    'open_temp': round(current['temp'], 2),
-                    'open_feels_like': round(current['feels_like'], 2),
-                    'open_humidity': int(current['humidity']),
-                    "open_pressure": int(current['pressure']),
-                    "open_clouds": round(current['clouds'], 0),
-                    "open_visibility": round(current['visibility'], 0),
-                    "open_wind_speed": round(current['wind_speed'], 2),
-                    "open_wind_gust": round(current['wind_gust'], 2) if current.get("wind_gust") else 0.0,
-                    "open_wind_deg": round(current['wind_deg'], 0),
-
-                    "open_rain": round(current['rain']["1h"], 2) if current.get('rain') else 0.0,  # mm/h
-                    "open_snow": round(current['snow']["1h"], 2) if current.get('snow') else 0.0,  # mm/h
-
-                    "open_description": f"{current['weather'][0]['main']}, {current['weather'][0]['description']}" if current.get('weather') else '',
-                    "open_icon": current['weather'][0]['icon'] if current.get('weather') else '',
-                    'open_sunrise': datetime.fromtimestamp(current['sunrise']),
-                    'open_sunset': datetime.fromtimestamp(current['sunset']),
-                    'open_uvi': round(current['uvi'], 2)  # https://fr.wikipedia.org/wiki/Indice_UV
-                }
-
+            data: dict[str, Any] | None = self.__get_data(response.json())
+            if data is not None:
                 result_queue.put(data)
-            else:
-                log.error(json.dumps(resp, indent=4, sort_keys=True))
         except Exception as ex:
             log.error(ex)
             log.error(traceback.format_exc())
         log.info(' End load_open_weather '.center(100, '*'))
 
+    async def collect(self) -> dict[str, Any]:
+        log.info(' Start collect open_weather '.center(100, '*'))
+        async with aiohttp.ClientSession() as session:
+            async with session.get(WEATHER_URL) as response:
+                data: dict[str, Any] | None = self.__get_data(await response.json(content_type=None))
+        log.info(' End collect open_weather '.center(100, '*'))
+        return data if data is not None else {}
+
+    def __get_data(self, resp: dict[str, Any]) -> dict[str, Any] | None:
+        log.info(json.dumps(resp, indent=4, sort_keys=True))
+
+        if "cod" in resp:
+            log.error(json.dumps(resp, indent=4, sort_keys=True))
+        elif "current" in resp:
+            current = resp['current']
+            return {
+                'open_temp': round(current['temp'], 2),
+                'open_feels_like': round(current['feels_like'], 2),
+                'open_humidity': int(current['humidity']),
+                "open_pressure": int(current['pressure']),
+                "open_clouds": round(current['clouds'], 0),
+                "open_visibility": round(current['visibility'], 0),
+                "open_wind_speed": round(current['wind_speed'], 2),
+                "open_wind_gust": round(current['wind_gust'], 2) if current.get("wind_gust") else 0.0,
+                "open_wind_deg": round(current['wind_deg'], 0),
+
+                "open_rain": round(current['rain']["1h"], 2) if current.get('rain') else 0.0,  # mm/h
+                "open_snow": round(current['snow']["1h"], 2) if current.get('snow') else 0.0,  # mm/h
+
+                "open_description": f"{current['weather'][0]['main']}, {current['weather'][0]['description']}" if current.get('weather') else '',
+                "open_icon": current['weather'][0]['icon'] if current.get('weather') else '',
+                'open_sunrise': datetime.fromtimestamp(current['sunrise']),
+                'open_sunset': datetime.fromtimestamp(current['sunset']),
+                'open_uvi': round(current['uvi'], 2)  # https://fr.wikipedia.org/wiki/Indice_UV
+            }
+        else:
+            log.error(json.dumps(resp, indent=4, sort_keys=True))
+        return None
 
 if __name__ == "__main__":
     thermopro.set_up(__file__)
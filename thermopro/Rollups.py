@@ -0,0 +1,184 @@
+import glob
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+import thermopro
+from thermopro import log
+from thermopro.HistoryStore import HistoryStore
+from thermopro.constants import THERMO_PRO_SCAN_STORE_PATH, ZERO_IS_MISSING
+
+STATS: list[str] = ['count', 'sum', 'min', 'max', 'last']
+
+
+# Materialized daily and monthly tiers of the hourly history, stored next to the segments:
+#   daily_2025.json -> one record per day:   time, first_time, last_time, {col}_count, {col}_sum, {col}_min, ...
+#   monthly.json    -> one record per month, built from the daily records
+# New hourly rows are merged into their day, a row replacing an hour already counted (the Hydro-Québec backfill)
+# recomputes its day from the store. Only the touched years and months are rewritten.
+# The rollups are built from the hourly rows, they keep the full resolution of the days thinned by the retention.
+class Rollups:
+
+    def __init__(self, path: str = THERMO_PRO_SCAN_STORE_PATH):
+        self.path: str = path
+        self.monthly_file: str = f'{path}/monthly.json'
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.monthly_file)
+
+    def rebuild(self, df: DataFrame) -> None:
+        # The days thinned by HistoryStore.compact() can't be rebuilt from the hourly rows anymore, they are kept
+        compacted_until: str | None = HistoryStore(self.path).read_manifest().get('compacted_until')
+        kept: DataFrame | None = None
+        if compacted_until is not None and self.exists():
+            kept = self.load('daily', end=pd.Timestamp(compacted_until).normalize())
+            df = df[pd.to_datetime(df['time']) >= pd.Timestamp(compacted_until).normalize() + timedelta(days=1)]
+        for file in glob.glob(f'{self.path}/daily_*.json'):
+            os.remove(file)
+        daily: DataFrame = self.__aggregate(df)
+        if kept is not None and len(kept) > 0:
+            daily = pd.concat([kept, daily], ignore_index=True)
+        self.__save_daily(daily)
+        self.__save_monthly(self.__combine_days(daily, daily['time'].dt.to_period('M').dt.to_timestamp()))
+        log.info(f'Rollups rebuilt: {len(daily)} days from {len(df)} rows')
+
+    def update(self, df: DataFrame) -> None:
+        if df is None or len(df) == 0:
+            return
+        if not self.exists():
+            self.rebuild(HistoryStore(self.path).load())
+            return
+
+        new: DataFrame = self.__aggregate(df)
+        daily: DataFrame = self.load('daily', start=new['time'].min(), end=new['time'].max())
+        daily = daily.set_index('time')
+        new = new.set_index('time')
+
+        # An hour already counted in its day can't be merged, the day is recomputed from the hourly rows
+        common: pd.Index = new.index.intersection(daily.index)
+        stale: pd.Index = common[new.loc[common, 'first_time'] <= daily.loc[common, 'last_time']]
+        mergeable: pd.Index = common.difference(stale)
+        columns: list[str] = self.__columns(df)
+        counts: list[str] = [f'{col}_count' for col in columns] + [f'{col}_sum' for col in columns]
+        mins: list[str] = [f'{col}_min' for col in columns]
+        maxs: list[str] = [f'{col}_max' for col in columns]
+        lasts: list[str] = [f'{col}_last' for col in columns]
+        # A column added since these days were counted had no sample in them
+        daily = daily.reindex(columns=list(daily.columns) + [col for col in new.columns if col not in daily.columns])
+        daily[counts] = daily[counts].fillna(0)
+        daily.loc[mergeable, counts] = daily.loc[mergeable, counts].to_numpy() + new.loc[mergeable, counts].to_numpy()
+        daily.loc[mergeable, mins] = np.fmin(daily.loc[mergeable, mins].to_numpy(), new.loc[mergeable, mins].to_numpy())
+        daily.loc[mergeable, maxs] = np.fmax(daily.loc[mergeable, maxs].to_numpy(), new.loc[mergeable, maxs].to_numpy())
+        daily.loc[mergeable, lasts] = new.loc[mergeable, lasts].to_numpy()
+        daily.loc[mergeable, 'last_time'] = new.loc[mergeable, 'last_time']
+
+        recomputed: list[DataFrame] = [self.__aggregate(
+            HistoryStore(self.path).load(start=day, end=day + timedelta(days=1) - timedelta(seconds=1))).set_index(
+            'time') for day in stale]
+        daily = daily.drop(index=stale)
+        new = new.drop(index=stale)
+
+        added: pd.Index = new.index.difference(daily.index)
+        daily = pd.concat([daily, new.loc[added]] + recomputed).sort_index().copy().reset_index(names='time')
+        self.__save_daily(daily)
+
+        months: pd.Series = daily['time'].dt.to_period('M').dt.to_timestamp()
+        monthly: DataFrame = self.load('monthly')
+        updated: DataFrame = self.__combine_days(self.load('daily', start=months.min()), None)
+        monthly = pd.concat([monthly[monthly['time'] < months.min()], updated], ignore_index=True)
+        self.__save_monthly(monthly)
+        log.info(f'Rollups updated: {len(mergeable)} days merged, {len(stale)} recomputed, {len(added)} added')
+
+    def load(self, tier: str = 'daily', start: datetime | None = None, end: datetime | None = None) -> DataFrame:
+        if not self.exists():
+            self.rebuild(HistoryStore(self.path).load())
+
+        if tier == 'monthly':
+            files: list[str] = [self.monthly_file]
+        else:
+            files = sorted(glob.glob(f'{self.path}/daily_*.json'))
+            files = [file for file in files if
+                     (start is None or int(file[-9:-5]) >= pd.Timestamp(start).year) and
+                     (end is None or int(file[-9:-5]) <= pd.Timestamp(end).year)]
+
+        frames: list[DataFrame] = []
+        for file in files:
+            with open(file, 'r') as f:
+                frames.append(pd.DataFrame(json.load(f)))
+        df: DataFrame = pd.concat(frames, ignore_index=True) if len(frames) > 0 else pd.DataFrame(
+            columns=['time', 'first_time', 'last_time'])
+        df = df.astype({'time': 'datetime64[ns]', 'first_time': 'datetime64[ns]', 'last_time': 'datetime64[ns]'})
+        if start is not None:
+            df = df[df['time'] >= pd.Timestamp(start).normalize()]
+        if end is not None:
+            df = df[df['time'] <= pd.Timestamp(end)]
+        return df.sort_values(by='time').reset_index(drop=True)
+
+    def rolling_mean(self, columns: list[str], days: float, start: datetime | None = None) -> DataFrame:
+        daily: DataFrame = self.load('daily', start=start - timedelta(days=days) if start is not None else None)
+        daily = daily.set_index('time')
+        means: DataFrame = pd.DataFrame(index=daily.index)
+        for col in columns:
+            means[col] = (daily[f'{col}_sum'].rolling(window=f'{days}D').sum() /
+                          daily[f'{col}_count'].rolling(window=f'{days}D').sum())
+        means = means.reset_index()
+        return means if start is None else means[means['time'] >= pd.Timestamp(start).normalize()].reset_index(
+            drop=True)
+
+    def __aggregate(self, df: DataFrame) -> DataFrame:
+        df = df.sort_values(by='time')
+        times: pd.Series = pd.to_datetime(df['time'])
+        columns: list[str] = self.__columns(df)
+        values: DataFrame = df[columns].copy()
+        missing: list[str] = [col for col in ZERO_IS_MISSING if col in columns]
+        values[missing] = values[missing].where(values[missing] != 0)
+        grouped = values.groupby(times.dt.floor('D').rename('time'))
+        grouped_times = times.groupby(times.dt.floor('D').rename('time'))
+        daily: DataFrame = pd.concat([
+            grouped_times.min().rename('first_time'),
+            grouped_times.max().rename('last_time'),
+            grouped.count().add_suffix('_count'),
+            grouped.sum().add_suffix('_sum'),
+            grouped.min().add_suffix('_min'),
+            grouped.max().add_suffix('_max'),
+            grouped.last().add_suffix('_last')
+        ], axis=1).copy()
+        return daily.reset_index()
+
+    @staticmethod
+    def __combine_days(daily: DataFrame, keys: pd.Series | None) -> DataFrame:
+        keys = daily['time'].dt.to_period('M').dt.to_timestamp() if keys is None else keys
+        grouped = daily.groupby(keys.rename('time'))
+        aggregations: dict[str, str] = {'first_time': 'min', 'last_time': 'max'}
+        for col in daily.columns:
+            for stat in STATS:
+                if col.endswith(f'_{stat}'):
+                    aggregations[col] = stat if stat != 'count' else 'sum'
+        return grouped.agg(aggregations).copy().reset_index()
+
+    @staticmethod
+    def __columns(df: DataFrame) -> list[str]:
+        return [col for col in df.columns if thermopro.column_dtype(col) in ['int64', 'float64']]
+
+    def __save_daily(self, daily: DataFrame) -> None:
+        for year, df_year in daily.groupby(daily['time'].dt.year):
+            file: str = f'{self.path}/daily_{year}.json'
+            if os.path.exists(file):
+                with open(file, 'r') as f:
+                    df_old: DataFrame = pd.DataFrame(json.load(f)).astype({'time': 'datetime64[ns]'})
+                df_year = pd.concat([df_old[~df_old['time'].isin(df_year['time'])], df_year]).sort_values(by='time')
+            self.__write(file, df_year)
+
+    def __save_monthly(self, monthly: DataFrame) -> None:
+        self.__write(self.monthly_file, monthly)
+
+    @staticmethod
+    def __write(file: str, df: DataFrame) -> None:
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        records: list[dict[str, Any]] = json.loads(df.to_json(orient='records', date_format='iso'))
+        HistoryStore.publish(file, json.dumps(records))
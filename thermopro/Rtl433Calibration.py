@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+import sys
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any
+
+import thermopro
+from constants import BKP_SCRIPTS, RTL_433_CALIBRATION
+from thermopro import log
+from thermopro.Rtl433Supervisor import Rtl433Supervisor
+
+SENSOR_LIST_FILE: str = f'{BKP_SCRIPTS}/sensor_list.json'
+
+
+# Finds the decoders (-R) of the sensors of sensor_list.json: each band is listened to with all the decoders of rtl_433
+# (the -R of its args dropped, -G 4 for the ones disabled by default too) and -M protocol, until every sensor of the
+# band was heard twice, RTL_433_CALIBRATION seconds at most. The protocol that decoded a sensor most often is kept, the
+# args of the band get only those: rtl_433 doesn't run the other decoders on every sample. A band with a sensor not
+# heard twice keeps its -R: a protocol of its -R is only dropped when every sensor was heard, none of them with it.
+# sensor_list.json is edited in place (the tokens like {RTL_433_EXE_PATH} stay), the old one in sensor_list.json.bak.
+class Rtl433Calibration:
+
+    def __init__(self, duration: float = RTL_433_CALIBRATION):
+        self.duration: float = duration
+
+    def run(self) -> dict[str, list[int] | None]:
+        """The -R of each band, None for a band left as it is."""
+        thermopro.sensors = None
+        protocols: dict[str, list[int] | None] = {}
+        for freq, band in thermopro.get_sensors().items():
+            models: list[str] = [model for model, loc in band['sensors'].items() if loc is not None]
+            heard: dict[str, Counter] = self.__listen(freq, list(band['args']), models)
+            missing: list[str] = [model for model in models if sum(heard.get(model, Counter()).values()) < 2]
+            if len(missing) > 0:
+                log.warning(f'Calibration of {freq}: {missing} not heard twice, -R left as it is')
+                protocols[freq] = None
+            else:
+                protocols[freq] = sorted({heard[model].most_common(1)[0][0] for model in models})
+                unused: list[int] = [protocol for protocol in Rtl433Calibration.protocols(band['args']) if
+                                     all(protocol not in heard[model] for model in models)]
+                log.info(f'Calibration of {freq}: {protocols[freq]}, unused: {unused}, '
+                         f'{ {model: dict(counter) for model, counter in heard.items()} }')
+        self.save(protocols)
+        return protocols
+
+    def __listen(self, freq: str, args: list[str], models: list[str]) -> dict[str, Counter]:
+        heard: dict[str, Counter] = {}
+        end: datetime = datetime.now() + timedelta(seconds=self.duration)
+        supervisor: Rtl433Supervisor = Rtl433Supervisor(
+            Rtl433Supervisor.without(Rtl433Supervisor.without(Rtl433Supervisor.without(args, '-R'), '-T'), '-G') +
+            ['-G', '4', '-M', 'protocol'])
+        log.info(f'Calibration of {freq}: {models}, {self.duration:.0f} s at most')
+        try:
+            supervisor.start()
+            while (datetime.now() < end and not supervisor.done() and
+                   not all(sum(heard.get(model, Counter()).values()) >= 2 for model in models)):
+                data: dict[str, Any] | None = supervisor.read(0.5)
+                if data is not None and data.get('model') in models and data.get('protocol') is not None:
+                    heard.setdefault(data['model'], Counter())[int(data['protocol'])] += 1
+        finally:
+            supervisor.stop()
+        return heard
+
+    @staticmethod
+    def protocols(args: list[str | int]) -> list[int]:
+        """The -R of args, as -R 02 or -R 2 or '-R 2'."""
+        tokens: list[str] = [token for arg in args for token in str(arg).split()]
+        return [int(value) for option, value in zip(tokens, tokens[1:]) if option == '-R' and value.isdigit()]
+
+    @staticmethod
+    def save(protocols: dict[str, list[int] | None], file: str = SENSOR_LIST_FILE) -> None:
+        with open(file, 'r', encoding='utf-8') as json_file:
+            sensor_list: dict[str, dict[str, Any]] = json.load(json_file)
+        changed: bool = False
+        for freq, ids in protocols.items():
+            if ids is None or freq not in sensor_list:
+                continue
+            args: list[str] = sensor_list[freq]['args']
+            # In place of the first -R, else at the end
+            at: int = next((i for i, arg in enumerate(args) if str(arg) == '-R' or str(arg).startswith('-R ')),
+                           len(args))
+            new_args: list[str] = ([str(arg) for arg in args[:at]] +
+                                   [token for protocol in ids for token in ['-R', str(protocol)]] +
+                                   Rtl433Supervisor.without(args[at:], '-R'))
+            if new_args != [str(arg) for arg in args]:
+                log.info(f'{freq}: {args} -> {new_args}')
+                sensor_list[freq]['args'] = new_args
+                changed = True
+        if changed:
+            shutil.copyfile(file, f'{file}.bak')
+            with open(file, 'w', encoding='utf-8') as json_file:
+                json.dump(sensor_list, json_file, indent=4, ensure_ascii=False)
+            thermopro.sensors = None
+            log.info(f'{file} saved, the old one in {os.path.basename(file)}.bak')
+
+
+if __name__ == '__main__':
+    thermopro.set_up(__file__)
+    calibration: Rtl433Calibration = Rtl433Calibration(float(sys.argv[1]) if len(sys.argv) > 1 else RTL_433_CALIBRATION)
+    print(thermopro.ppretty(calibration.run()))
@@ -0,0 +1,120 @@
+import threading
+import traceback
+from datetime import datetime, timedelta
+from typing import Any
+
+import thermopro
+from constants import RTL_433_DWELL
+from thermopro import log
+from thermopro.Rtl433Supervisor import Rtl433Supervisor
+from thermopro.SensorWindow import SensorWindow
+from thermopro.TransmitSchedule import TransmitSchedule
+
+
+# Always-on capture: rtl_433 keeps running (Rtl433Supervisor starts it again when it exits), and every reading of a
+# sensor of sensor_list.json goes in the SensorWindow of that sensor: readings has their medians, with the time of the
+# last one. The hourly scan takes a snapshot of readings (see Rtl433Temperature2.collect) instead of starting rtl_433
+# and waiting for each sensor to transmit.
+# All the bands at once when Rtl433Supervisor.captures() can (an SDR per band, or hopping). Else one SDR listens to one
+# band at a time: the capture moves to the next band once every sensor of the band was heard, or after RTL_433_DWELL.
+class Rtl433Daemon:
+
+    def __init__(self, schedule: TransmitSchedule):
+        self.schedule: TransmitSchedule = schedule
+        self.started: datetime = datetime.now()
+        self.readings: dict[str, dict[str, Any]] = {}
+        self.windows: dict[str, SensorWindow] = {}
+        self.lock: threading.Lock = threading.Lock()
+        self.stopping: threading.Event = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.supervisors: list[Rtl433Supervisor] = []
+
+    def start(self) -> None:
+        if self.is_running():
+            return
+        self.stopping.clear()
+        self.started = datetime.now()
+        self.thread = threading.Thread(target=self.__run, name='rtl_433', daemon=True)
+        self.thread.start()
+        log.info('rtl_433 capture started')
+
+    def stop(self) -> None:
+        self.stopping.set()
+        for supervisor in list(self.supervisors):
+            supervisor.stop()
+        if self.thread is not None:
+            self.thread.join(10)
+        log.info('rtl_433 capture stopped')
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def snapshot(self, max_age: timedelta) -> dict[str, dict[str, Any]]:
+        """The last reading of every sensor heard within max_age, by model."""
+        now: datetime = datetime.now()
+        with self.lock:
+            return {model: dict(data) for model, data in self.readings.items() if now - data['received'] <= max_age}
+
+    def __run(self) -> None:
+        while not self.stopping.is_set():
+            try:
+                sensors: dict[str, dict[str, Any]] = thermopro.get_sensors()
+                captures: dict[str, tuple[list[str], dict[str, str | None]]] | None = Rtl433Supervisor.captures(
+                    sensors)
+                if captures is not None:
+                    # All the bands at once, none is ever left
+                    workers: list[threading.Thread] = [threading.Thread(
+                        target=self.__keep_capturing, name=f'rtl_433 {name}',
+                        args=(name, args, [model for model, loc in bands.items() if loc is not None]), daemon=True)
+                        for name, (args, bands) in captures.items()]
+                    for worker in workers:
+                        worker.start()
+                    for worker in workers:
+                        worker.join()
+                    continue
+                for freq in sensors:
+                    models: list[str] = [model for model, loc in sensors[freq]['sensors'].items() if loc is not None]
+                    # Alone on the SDR, a band is never left
+                    dwell: float | None = RTL_433_DWELL if len(sensors) > 1 else None
+                    self.__capture(freq, list(sensors[freq]['args']), models, dwell)
+                    if self.stopping.is_set():
+                        break
+            except Exception as ex:
+                log.error(ex)
+                log.error(traceback.format_exc())
+                self.stopping.wait(10)
+
+    def __keep_capturing(self, name: str, args: list[str], models: list[str]) -> None:
+        while not self.stopping.is_set():
+            try:
+                self.__capture(name, args, models, None)
+            except Exception as ex:
+                log.error(ex)
+                log.error(traceback.format_exc())
+                self.stopping.wait(10)
+
+    def __capture(self, freq: str, args: list[str], models: list[str], dwell: float | None) -> None:
+        log.info(f'rtl_433 capture of {freq}: {models}, dwell: {dwell}')
+        start: datetime = datetime.now()
+        heard: set[str] = set()
+        supervisor: Rtl433Supervisor = Rtl433Supervisor(Rtl433Supervisor.without(args, '-T'))
+        self.supervisors.append(supervisor)
+        try:
+            supervisor.start()
+            while not self.stopping.is_set():
+                if dwell is not None and (heard >= set(models) or datetime.now() - start > timedelta(seconds=dwell)):
+                    break
+                if supervisor.done() and not supervisor.restart(self.stopping):
+                    break
+                data: dict[str, Any] | None = supervisor.read(0.5)
+                if data is not None and data.get('model') in models:
+                    self.schedule.arrive(data['model'])
+                    with self.lock:
+                        window: SensorWindow = self.windows.setdefault(data['model'], SensorWindow())
+                        if window.add(data):
+                            self.readings[data['model']] = window.reading() | {'received': datetime.now()}
+                    heard.add(data['model'])
+        finally:
+            supervisor.stop()
+            self.supervisors.remove(supervisor)
+            log.info(f'rtl_433 capture of {freq} done, heard: {sorted(heard)}')
@@ -0,0 +1,81 @@
+import json
+import subprocess
+import threading
+from collections import deque
+from queue import Queue, Empty
+from typing import Any
+
+from thermopro import log
+
+
+# Reads the pipes of a rtl_433 started by Rtl433Supervisor: a thread reads the lines of its stdout as they come and
+# queues the decoded readings of -F json, read() waits for the next one at most timeout seconds. No temp file to wait
+# for, delete or tail, a reading is there as soon as rtl_433 writes it. Threads, not select(): a pipe can't be selected
+# on Windows. The last lines of stderr are kept for the log when rtl_433 exits.
+class Rtl433Reader:
+
+    def __init__(self, process: subprocess.Popen):
+        self.process: subprocess.Popen = process
+        self.readings: Queue = Queue()
+        self.errors: deque[str] = deque(maxlen=20)
+        self.eof: threading.Event = threading.Event()
+        self.threads: list[threading.Thread] = [
+            threading.Thread(target=self.__read_stdout, name='rtl_433 stdout', daemon=True),
+            threading.Thread(target=self.__read_stderr, name='rtl_433 stderr', daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def read(self, timeout: float) -> dict[str, Any] | None:
+        """The next reading, None when none came within timeout or rtl_433 is done."""
+        try:
+            return self.readings.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def done(self) -> bool:
+        """rtl_433 exited and every reading was read."""
+        return self.eof.is_set() and self.readings.empty()
+
+    def join(self, timeout: float) -> None:
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def __read_stdout(self) -> None:
+        try:
+            for line in self.process.stdout:
+                line = line.strip()
+                if not line.startswith('{'):
+                    continue
+                try:
+                    self.readings.put(json.loads(line))
+                except json.JSONDecodeError as ex:
+                    log.warning(f'rtl_433 line skipped: {ex}, {line[:80]}')
+        finally:
+            self.eof.set()
+
+    def __read_stderr(self) -> None:
+        for line in self.process.stderr:
+            if line.strip():
+                self.errors.append(line.strip())
+
+    @staticmethod
+    def pipe_args(args: list[str]) -> list[str]:
+        """args with the -F json:file of sensor_list.json as -F json, the JSON output on stdout."""
+        piped: list[str] = []
+        json_output: bool = False
+        for i, arg in enumerate(str(arg) for arg in args):
+            if arg.startswith('json') and i > 0 and str(args[i - 1]) == '-F':
+                if not json_output:
+                    piped.append('json')
+                    json_output = True
+                else:
+                    piped.pop()
+            elif arg.startswith('-F json'):
+                if not json_output:
+                    piped.append('-F json')
+                    json_output = True
+            else:
+                piped.append(arg)
+        if not json_output:
+            piped.extend(['-F', 'json'])
+        return piped
@@ -0,0 +1,152 @@
+import os
+import re
+import subprocess
+import threading
+import time
+import traceback
+from typing import Any
+
+from constants import RTL_433_BACKOFF, RTL_433_DEVICES, RTL_433_HOP, RTL_433_EXE
+from thermopro import log
+from thermopro.Rtl433Reader import Rtl433Reader
+
+
+# Owns the rtl_433 child process: started with Popen, alive while poll() is None, stopped with terminate() then kill().
+# No tasklist/taskkill spawned to find it, the same on Linux and Windows, except once before the first start of the
+# process: an RTL_433_EXE left by a crash or a killed scan holds the SDR, see kill_strays(). restart() waits a backoff
+# first, doubled each time rtl_433 didn't stay up longer than the biggest one (no SDR, SDR busy), back to the first one
+# after that.
+# pipe: -F json on stdout (see Rtl433Reader), else the args of sensor_list.json as they are (-F json:file)
+class Rtl433Supervisor:
+    strays_killed: bool = False
+    strays_lock: threading.Lock = threading.Lock()
+
+    def __init__(self, args: list[str | int], pipe: bool = True):
+        self.args: list[str] = Rtl433Reader.pipe_args(args) if pipe else [str(arg) for arg in args]
+        self.process: subprocess.Popen | None = None
+        self.reader: Rtl433Reader | None = None
+        self.started: float = 0
+        self.backoff: float = RTL_433_BACKOFF[0]
+        self.stopped: bool = False
+        self.lock: threading.Lock = threading.Lock()
+
+    def start(self) -> None:
+        Rtl433Supervisor.kill_strays()
+        with self.lock:
+            log.info(f'ARGS={self.args}')
+            self.process = subprocess.Popen(self.args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                            encoding='utf-8', errors='replace', bufsize=1)
+            self.reader = Rtl433Reader(self.process)
+            self.started = time.monotonic()
+            self.stopped = False
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def done(self) -> bool:
+        """rtl_433 exited and every reading of its stdout was read."""
+        return self.reader is None or self.reader.done()
+
+    def read(self, timeout: float) -> dict | None:
+        if self.reader is None:
+            return None
+        return self.reader.read(timeout)
+
+    def restart(self, stopping: threading.Event) -> bool:
+        """Starts rtl_433 again after the backoff, False when stopping was set meanwhile."""
+        self.stop()
+        if time.monotonic() - self.started > RTL_433_BACKOFF[1]:
+            self.backoff = RTL_433_BACKOFF[0]
+        log.warning(f'rtl_433 started again in {self.backoff:g} s')
+        if stopping.wait(self.backoff):
+            return False
+        self.backoff = min(self.backoff * 2, RTL_433_BACKOFF[1])
+        self.start()
+        return True
+
+    def stop(self) -> int | None:
+        with self.lock:
+            process: subprocess.Popen | None = self.process
+            if process is None or self.stopped:
+                return process.returncode if process else None
+            self.stopped = True
+            # Exited on its own, not terminated here
+            exited: bool = process.poll() is not None
+            if not exited:
+                process.terminate()
+                try:
+                    process.wait(5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait(5)
+            self.reader.join(5)
+            if exited and process.returncode not in [0, 1]:
+                log.warning(f'rtl_433 return code: {process.returncode}, {' '.join(self.reader.errors)}')
+            log.info(f'rtl_433 stopped, return code: {process.returncode}')
+            return process.returncode
+
+    @staticmethod
+    def kill_strays() -> None:
+        """Kills the RTL_433_EXE still running, once per process: before its first rtl_433, none of them is ours."""
+        with Rtl433Supervisor.strays_lock:
+            if Rtl433Supervisor.strays_killed:
+                return
+            Rtl433Supervisor.strays_killed = True
+            try:
+                completed_process = subprocess.run(
+                    ['taskkill', '/F', '/T', '/IM', RTL_433_EXE] if os.name == 'nt' else
+                    # The program of the command line, not any command line naming it
+                    ['pkill', '-f', f'^([^ ]*/)?{re.escape(RTL_433_EXE)}( |$)'],
+                    capture_output=True,
+                    timeout=10,
+                    check=False,
+                    text=True
+                )
+                if completed_process.returncode == 0:
+                    log.warning(f'Stray {RTL_433_EXE} killed, it held the SDR')
+            except Exception as ex:
+                log.error(ex)
+                log.error(traceback.format_exc())
+
+    @staticmethod
+    def without(args: list[str | int], option: str) -> list[str]:
+        """args without option and its value, the -T of sensor_list.json for a capture that doesn't end on its own."""
+        kept: list[str] = []
+        skip: bool = False
+        for arg in args:
+            if skip:
+                skip = False
+            elif str(arg) == option:
+                skip = True
+            elif not str(arg).startswith(f'{option} '):
+                kept.append(str(arg))
+        return kept
+
+    @staticmethod
+    def captures(sensors: dict[str, dict[str, Any]], pipe: bool = True) \
+            -> dict[str, tuple[list[str], dict[str, str | None]]] | None:
+        """The rtl_433 runs covering all the bands of sensor_list.json at once, {name: (args, sensors)}, None when the
+        bands are captured one after the other. One SDR per band needs the pipe: the runs can't share one -F json:file.
+        """
+        if len(sensors) < 2:
+            return None
+        if pipe and all(freq in RTL_433_DEVICES for freq in sensors):
+            return {freq: ([str(arg) for arg in sensors[freq]['args']] + ['-d', str(RTL_433_DEVICES[freq])],
+                           dict(sensors[freq]['sensors'])) for freq in sensors}
+        if RTL_433_HOP > 0:
+            bands: dict[str, str | None] = {}
+            for freq in sensors:
+                bands.update(sensors[freq]['sensors'])
+            return {'+'.join(sensors): (Rtl433Supervisor.__hop_args(sensors), bands)}
+        return None
+
+    @staticmethod
+    def __hop_args(sensors: dict[str, dict[str, Any]]) -> list[str]:
+        # The args of the first band, with the -f (and -R, when the first band has some) of the others
+        args: list[str] = [str(arg) for arg in list(sensors.values())[0]['args']]
+        for band in list(sensors.values())[1:]:
+            band_args: list[str] = [str(arg) for arg in band['args']]
+            for option, value in zip(band_args, band_args[1:]):
+                if option in ['-f', '-R'] and option in args and (option, value) not in zip(args, args[1:]):
+                    args.extend([option, value])
+        return args + ['-H', str(RTL_433_HOP)]
@@ -1,27 +1,76 @@
+import asyncio
 import ctypes
 import json
 import os
-import subprocess
 import threading
 import traceback
-from datetime import datetime
+from datetime import datetime, timedelta
 from queue import Queue
 from time import sleep
 from typing import Any
 
 import thermopro
-from constants import TIMEOUT, OUTPUT_RTL_433_FILE, RTL_433_EXE
+from constants import TIMEOUT, OUTPUT_RTL_433_FILE, RTL_433_DAEMON, RTL_433_MAX_AGE, RTL_433_DWELL, RTL_433_PIPE, \
+    RTL_433_BURST, RTL_433_IDLE
 from thermopro import log
+from thermopro.Rtl433Daemon import Rtl433Daemon
+from thermopro.Rtl433Supervisor import Rtl433Supervisor
+from thermopro.SensorWindow import SensorWindow
+from thermopro.TransmitSchedule import TransmitSchedule
+from thermopro.Source import Source
 
 
 # rtl_433_64bit_static.exe -R 02 -R 162 -R 245 -f 433M -f 915M
 
 
-class Rtl433Temperature2:
+class Rtl433Temperature2(Source):
+    name: str = 'rtl_433'
 
     def __init__(self):
+        super().__init__()
         log.info(' Start Rtl433Temperature2 '.center(100, '*'))
         thermopro.sensors = None
+        self.schedule: TransmitSchedule = TransmitSchedule()
+        self.daemon: Rtl433Daemon = Rtl433Daemon(self.schedule)
+
+    async def collect(self) -> dict[str, dict[str, int | float | str | None]]:
+        # sensor_list.json is read again at every poll
+        thermopro.sensors = None
+        if not RTL_433_DAEMON:
+            return await self.in_thread(self.call_rtl_433)
+
+        self.daemon.start()
+        start: datetime = datetime.now()
+        # Right after the start of the capture, until every sensor was heard once
+        while (len(self.__missing(self.daemon.snapshot(timedelta(seconds=RTL_433_MAX_AGE)))) > 0 and
+               datetime.now() - start < timedelta(seconds=RTL_433_DWELL)):
+            await asyncio.sleep(1)
+        return {'sensors': self.snapshot()}
+
+    def snapshot(self) -> dict[str, int | float | str | None]:
+        """The last reading of every sensor from the capture of the daemon, like call_rtl_433 gives them."""
+        json_rtl_433: dict[str, int | float | str | None] = {}
+        threads: list[threading.Thread] = []
+        readings: dict[str, dict[str, Any]] = self.daemon.snapshot(timedelta(seconds=RTL_433_MAX_AGE))
+        for model, loc in self.__locations().items():
+            if model in readings:
+                data: dict[str, Any] = self.__fill_dict(dict(readings[model]), [], [], [], [], loc)
+                self.__warn_battery(data, threads)
+                for key in [f'{loc}_temp_{model}', f'{loc}_humidity_{model}']:
+                    json_rtl_433[key] = data[key]
+                log.info(f'>>>>>> {loc} {model}: {data.get('temperature_C')}°C {data.get('humidity')}%, '
+                         f'received: {data['received']:%H:%M:%S}')
+        self.__warn_not_respondig(self.__missing(readings))
+        self.__warn_late(self.schedule.late(list(self.__missing(readings)), self.daemon.started))
+        self.schedule.save()
+        return json_rtl_433
+
+    def __locations(self) -> dict[str, str]:
+        return {model: loc for freq in thermopro.get_sensors() for model, loc in
+                thermopro.get_sensors()[freq]['sensors'].items() if loc is not None}
+
+    def __missing(self, readings: dict[str, dict[str, Any]]) -> dict[str, str]:
+        return {model: loc for model, loc in self.__locations().items() if model not in readings}
 
     def call_rtl_433(self, result_queue: Queue):
         log.info(' Start call_rtl_433 '.center(100, '*'))
@@ -36,18 +85,33 @@ class Rtl433Temperature2:
         summary_list: list[str] = []
 
         try:
-            self.__kill_rtl_433()
-            self.__delete_json_file()
-
+            captures: dict[str, tuple[list[str], dict[str, str | None]]] | None = Rtl433Supervisor.captures(
+                thermopro.get_sensors(), RTL_433_PIPE)
             for freq in thermopro.get_sensors():
                 for sensor in thermopro.get_sensors()[freq]['sensors'].keys():
                     sensor_size = max(len(sensor), sensor_size)
 
                 sensors_list.update(thermopro.get_sensors()[freq]['sensors'])
-                summary_list.extend(self.__call_sensors(list(thermopro.get_sensors()[freq]['args']),
-                                                        dict(thermopro.get_sensors()[freq]['sensors']), json_rtl_433,
-                                                        ext_humidity_list, ext_temp_list, int_humidity_list,
-                                                        int_temp_list, threads))
+                if captures is None:
+                    summary_list.extend(self.__call_sensors(list(thermopro.get_sensors()[freq]['args']),
+                                                            dict(thermopro.get_sensors()[freq]['sensors']),
+                                                            json_rtl_433, ext_humidity_list, ext_temp_list,
+                                                            int_humidity_list, int_temp_list, threads))
+
+            if captures is not None:
+                # All the bands at once: as long as the slowest band, not the sum of the bands
+                summaries: dict[str, list[str]] = {}
+                workers: list[threading.Thread] = [threading.Thread(
+                    target=lambda name=name, args=args, sensors=sensors: summaries.update(
+                        {name: self.__call_sensors(list(args), dict(sensors), json_rtl_433, ext_humidity_list,
+                                                   ext_temp_list, int_humidity_list, int_temp_list, threads)}),
+                    name=f'rtl_433 {name}') for name, (args, sensors) in captures.items()]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                for name in captures:
+                    summary_list.extend(summaries.get(name, []))
 
             for item in ['time', 'temperature_C', 'model', 'subtype', 'id', 'channel', 'battery_ok', 'button', 'mic',
                          'humidity', 'status', 'flags', 'data', 'mod', 'noise', 'rssi', 'snr', 'freq', 'freq1',
@@ -60,9 +124,6 @@ class Rtl433Temperature2:
             log.error(f"An unexpected error occurred: {e}")
             log.error(traceback.format_exc())
 
-        self.__kill_rtl_433()
-        self.__delete_json_file()
-
         log.info('\n' + "".join(summary_list))
         for loc in ['ext', 'int', None]:
             for freq in list(thermopro.get_sensors().keys()):
@@ -79,6 +140,7 @@ class Rtl433Temperature2:
                         )
 
         result_queue.put({'sensors': json_rtl_433})
+        self.schedule.save()
 
         if len(threads) > 0:
             for thread in threads:
@@ -96,47 +158,46 @@ class Rtl433Temperature2:
         for sensor in list(sensors.keys()):
             sensors.pop(sensor) if sensors[sensor] is None else None
 
+        if RTL_433_PIPE:
+            self.__pipe_sensors(args, sensors, json_rtl_433, ext_humidity_list, ext_temp_list, int_humidity_list,
+                                int_temp_list, threads, summary)
+            log.info(f' End __call_sensors '.center(100, '*'))
+            return summary
+
+        supervisor: Rtl433Supervisor = Rtl433Supervisor(args, pipe=False)
+        windows: dict[str, SensorWindow] = {}
         try:
-            self.__kill_rtl_433()
+            # The -T of sensor_list.json ends rtl_433, this is in case it doesn't
+            deadline: datetime = datetime.now() + timedelta(seconds=TIMEOUT + 5)
+            self.__sleep(self.schedule.wait(list(sensors.keys())), deadline)
+            since: datetime = datetime.now()
             self.__delete_json_file()
-
-            thread: threading.Thread = threading.Thread(target=self.__start_rtl_433, args=(args,))
-            thread.start()
+            supervisor.start()
 
             i: int = 0
-            while not os.path.exists(OUTPUT_RTL_433_FILE) and i < 1000:
+            while not os.path.exists(OUTPUT_RTL_433_FILE) and supervisor.is_alive() and i < 1000:
                 i += 1
                 sleep(0.2)
             if not os.path.exists(OUTPUT_RTL_433_FILE):
                 raise Exception(
-                    f'File not found: {OUTPUT_RTL_433_FILE} and is_rtl_433_alive: {self.__is_rtl_433_alive()} and i: {i}')
-            log.info(f"Found file {OUTPUT_RTL_433_FILE} and is_rtl_433_alive: {self.__is_rtl_433_alive()} and i: {i}")
+                    f'File not found: {OUTPUT_RTL_433_FILE} and is_alive: {supervisor.is_alive()} and i: {i}')
+            log.info(f"Found file {OUTPUT_RTL_433_FILE} and is_alive: {supervisor.is_alive()} and i: {i}")
 
             with open(OUTPUT_RTL_433_FILE, 'r') as f:
                 f.seek(0, 2)
-                while len(sensors.keys()) != 0 and self.__is_rtl_433_alive():
+                while ((len(sensors.keys()) != 0 or self.__learning(windows)) and supervisor.is_alive() and
+                       datetime.now() < deadline):
                     line = f.readline()
                     if not line:
                         sleep(0.1)
-                        continue
-                    else:
-                        data: dict = json.loads(line.strip())
-                        model: str = data['model']
-                        log.info(f'{model}, {list(sensors.keys())}')
-                        if model in sensors.keys():
-                            log.info(f'>>>>>> {data.get('model')}: {data}')
-                            data['loc'] = sensors.get(data.get('model'))
-                            self.append_summary(data, summary)
-
-                            data = self.__fill_dict(data, ext_humidity_list, ext_temp_list, int_humidity_list,
-                                                    int_temp_list, sensors[model])
-                            self.__warn_battery(data, threads)
-                            sensors.pop(model)
-                            log.info(f'Removed: {model}')
-                            json_rtl_433.update(data)
-                    if len(sensors.keys()) == 0 or not self.__is_rtl_433_alive():
-                        log.info(f'Done! keys: {list(sensors.keys())}, is alive: {self.__is_rtl_433_alive()}')
+                    self.__on_reading(json.loads(line.strip()) if line else None, sensors, windows, json_rtl_433,
+                                      ext_humidity_list, ext_temp_list, int_humidity_list, int_temp_list, threads,
+                                      summary)
+                    if self.__only_late(sensors, windows, since):
                         break
+                self.__on_reading(None, sensors, windows, json_rtl_433, ext_humidity_list, ext_temp_list,
+                                  int_humidity_list, int_temp_list, threads, summary, True)
+                log.info(f'Done! keys: {list(sensors.keys())}, is alive: {supervisor.is_alive()}')
 
             self.__warn_not_respondig(sensors)
 
@@ -144,12 +205,97 @@ class Rtl433Temperature2:
             log.error(f"An unexpected error occurred: {e}")
             log.error(traceback.format_exc())
         finally:
-            self.__kill_rtl_433()
+            supervisor.stop()
             self.__delete_json_file()
 
         log.info(f' End __call_sensors '.center(100, '*'))
         return summary
 
+    def __pipe_sensors(self, args: list[str | int], sensors: dict, json_rtl_433: dict[str, Any],
+                       ext_humidity_list: list[int], ext_temp_list: list[float], int_humidity_list: list[int],
+                       int_temp_list: list[float], threads: list[threading.Thread], summary: list[str]) -> None:
+        supervisor: Rtl433Supervisor = Rtl433Supervisor(args)
+        windows: dict[str, SensorWindow] = {}
+        try:
+            # The -T of sensor_list.json ends rtl_433, this is in case it doesn't
+            deadline: datetime = datetime.now() + timedelta(seconds=TIMEOUT + 5)
+            self.__sleep(self.schedule.wait(list(sensors.keys())), deadline)
+            since: datetime = datetime.now()
+            supervisor.start()
+            while ((len(sensors.keys()) != 0 or self.__learning(windows)) and not supervisor.done() and
+                   datetime.now() < deadline):
+                self.__on_reading(supervisor.read(0.5), sensors, windows, json_rtl_433, ext_humidity_list,
+                                  ext_temp_list, int_humidity_list, int_temp_list, threads, summary)
+                if self.__only_late(sensors, windows, since):
+                    break
+                # Nothing expected for a while: the SDR is off until just before
+                wait: float = self.schedule.wait(list(sensors.keys()))
+                if wait > RTL_433_IDLE and all(model not in windows for model in sensors.keys()):
+                    supervisor.stop()
+                    self.__sleep(wait, deadline)
+                    supervisor.start()
+            self.__on_reading(None, sensors, windows, json_rtl_433, ext_humidity_list, ext_temp_list,
+                              int_humidity_list, int_temp_list, threads, summary, True)
+            log.info(f'Done! keys: {list(sensors.keys())}, rtl_433 done: {supervisor.done()}')
+            self.__warn_not_respondig(sensors)
+        except Exception as e:
+            log.error(f"An unexpected error occurred: {e}")
+            log.error(traceback.format_exc())
+        finally:
+            supervisor.stop()
+
+    def __learning(self, windows: dict[str, SensorWindow]) -> bool:
+        """A sensor heard whose period is not known yet: the capture goes on until its next burst, the interval
+        between the two is its period (one burst per capture only gives the cadence of the captures)."""
+        return any(self.schedule.period(model) is None for model in windows)
+
+    def __only_late(self, sensors: dict, windows: dict[str, SensorWindow], since: datetime) -> bool:
+        """Only late sensors left to hear: no use waiting for them."""
+        pending: list[str] = [model for model in sensors.keys() if model not in windows]
+        late: dict[str, float] = self.schedule.late(pending, since)
+        if len(pending) == 0 or len(pending) != len(sensors.keys()) or len(late) != len(pending):
+            return False
+        self.__warn_late(late)
+        return True
+
+    @staticmethod
+    def __sleep(seconds: float, deadline: datetime) -> None:
+        seconds = min(seconds, (deadline - datetime.now()).total_seconds())
+        if seconds > 0:
+            log.info(f'rtl_433 off for {seconds:.0f} s, until the next transmission expected')
+            sleep(seconds)
+
+    def __on_reading(self, data: dict | None, sensors: dict, windows: dict[str, SensorWindow],
+                     json_rtl_433: dict[str, Any], ext_humidity_list: list[int], ext_temp_list: list[float],
+                     int_humidity_list: list[int], int_temp_list: list[float], threads: list[threading.Thread],
+                     summary: list[str], final: bool = False) -> None:
+        if data is not None:
+            model: str = data['model']
+            log.info(f'{model}, {list(sensors.keys())}')
+            if model in sensors.keys() or model in windows:
+                self.schedule.arrive(model)
+            if model in sensors.keys():
+                log.info(f'>>>>>> {data.get('model')}: {data}')
+                windows.setdefault(model, SensorWindow()).add(data)
+
+        # A sensor is done once the repeats of its first frame had RTL_433_BURST seconds to come, or at the end
+        for model, window in windows.items():
+            if model not in sensors.keys() or window.first() is None or (
+                    not final and datetime.now() - window.first() < timedelta(seconds=RTL_433_BURST)):
+                continue
+            data = window.reading()
+            log.info(f'>>>>>> {model}: median of {window.size()} frames, {data.get('temperature_C')}°C '
+                     f'{data.get('humidity')}%')
+            data['loc'] = sensors.get(model)
+            self.append_summary(data, summary)
+
+            data = self.__fill_dict(data, ext_humidity_list, ext_temp_list, int_humidity_list,
+                                    int_temp_list, sensors[model])
+            self.__warn_battery(data, threads)
+            sensors.pop(model)
+            log.info(f'Removed: {model}')
+            json_rtl_433.update(data)
+
     def append_summary(self, data: dict, summary: list[str]):
         summary.append(f' {int(data.get("freq")) if data.get("freq") else int(data.get("freq1"))} MHz {data.get('loc')} '.center(84, '-') + '\n')
         summary.append(f'Model     : {data.get("model")}'.ljust(52) + f'Time      : {data.get("time")}\n')
@@ -163,65 +309,6 @@ class Rtl433Temperature2:
         )
         summary.append(f'RSSI      : {data.get("rssi")}dB'.ljust(26) + f'SNR       : {data.get("snr")}dB'.ljust(26) + f'Noise     : {data.get("noise")}dB'.ljust(26) + '\n')
 
-    def __is_rtl_433_alive(self) -> bool | None:
-        try:
-            completed_process = subprocess.run(
-                ['tasklist', '/FI', f'IMAGENAME eq {RTL_433_EXE}', '/FO', 'csv', '/nh'],
-                capture_output=True,
-                timeout=10,
-                check=False,
-                shell=True,
-                text=True
-            )
-            return RTL_433_EXE in completed_process.stdout
-        except Exception as ex:
-            log.error(ex)
-            log.error(traceback.format_exc())
-
-    def __kill_rtl_433(self) -> None:
-        try:
-            if self.__is_rtl_433_alive():
-                completed_process = subprocess.run(
-                    ['taskkill', '/F', '/T', '/IM', RTL_433_EXE],
-                    capture_output=True,
-                    timeout=10,
-                    check=False,
-                    shell=True,
-                    text=True
-                )
-                if completed_process.returncode == 0:
-                    log.info(f'{RTL_433_EXE} killed.')
-                else:
-                    log.warning(
-                        f'Return code: {completed_process.returncode}, stdout: {completed_process.stdout.replace('\n', ' ')}, stderr: {completed_process.stderr.replace('\n', ' ')}')
-        except Exception as ex:
-            log.error(ex)
-            log.error(traceback.format_exc())
-
-    def __start_rtl_433(self, args: list[str]) -> str | None:
-        try:
-            log.info(f'ARGS={args}')
-            completed_process = subprocess.run(
-                args,
-                capture_output=True,
-                timeout=TIMEOUT + 5,
-                encoding="utf-8",
-                check=False,
-                shell=True,
-                text=True
-            )
-            if completed_process.returncode == 0 or completed_process.returncode == 1:
-                log.info(f'{RTL_433_EXE} stopped.')
-            else:
-                log.warning(
-                    f'{RTL_433_EXE} return code: {completed_process.returncode}, {completed_process.stdout.replace('\n', ' ')}, {completed_process.stderr.replace('\n', ' ')}')
-
-        except subprocess.TimeoutExpired as timeoutExpired:
-            log.error(f"TimeoutExpired, returned: {timeoutExpired}")
-        except Exception as ex:
-            log.error(ex)
-            log.error(traceback.format_exc())
-
     def __delete_json_file(self):
         if os.path.exists(OUTPUT_RTL_433_FILE):
             try:
@@ -237,6 +324,14 @@ class Rtl433Temperature2:
             log.warning('*' + f'Sensor{'s' if len(sensors) > 1 else ''} {list(sensors)} NOT responding'.center(len(string) - 2) + '*')
             log.warning(string)
 
+    def __warn_late(self, late: dict[str, float]):
+        if len(late) > 0:
+            string: str = ' RTL 433 Warning '.center(80, '*')
+            log.warning(string)
+            log.warning('*' + f'Sensor{'s' if len(late) > 1 else ''} {list(late)} late: '
+                              f'{', '.join(f'{seconds:.0f} s' for seconds in late.values())}'.center(len(string) - 2) + '*')
+            log.warning(string)
+
     def __warn_battery(self, data: dict, threads: list[threading.Thread]):
         if data.get('battery_ok') == 0:
             string: str = ' RTL 433 Warning '.center(80, '*')
@@ -0,0 +1,80 @@
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any
+
+from constants import RTL_433_WINDOW, RTL_433_WINDOW_SIZE, RTL_433_BOUNDS, RTL_433_MAD_K, RTL_433_MAD_MIN
+from thermopro import log
+
+METRICS: list[str] = list(RTL_433_BOUNDS.keys())
+
+
+# Ring buffer of the last frames of one sensor, for a value that one corrupted frame can't change: the median of the
+# frames of the window, weighted by their repeats. A sensor sends each reading in a burst of identical frames, a repeat
+# of the last frame only counts one more. Values out of RTL_433_BOUNDS are dropped when added, the outliers (by MAD)
+# are left out of the median only: after a real change, the window fills with the new value and the median follows.
+# At most RTL_433_WINDOW_SIZE frames: the memory doesn't grow with the capture.
+class SensorWindow:
+
+    def __init__(self, size: int = RTL_433_WINDOW_SIZE, window: timedelta = timedelta(seconds=RTL_433_WINDOW)):
+        self.window: timedelta = window
+        # [key of the frame, received, {metric: value}, repeats]
+        self.frames: deque[list[Any]] = deque(maxlen=size)
+        self.last: dict[str, Any] = {}
+
+    def add(self, data: dict[str, Any], received: datetime | None = None) -> bool:
+        """False when the frame is dropped, a value out of bounds."""
+        received = received if received else datetime.now()
+        values: dict[str, float | None] = {metric: data.get(metric) for metric in METRICS}
+        for metric, value in values.items():
+            if value is not None and not RTL_433_BOUNDS[metric][0] <= value <= RTL_433_BOUNDS[metric][1]:
+                log.warning(f'{data.get('model')}: {metric} {value} out of {RTL_433_BOUNDS[metric]}, dropped')
+                return False
+        key: tuple = (data.get('time'), data.get('id'), data.get('channel'), *values.values())
+        if len(self.frames) > 0 and self.frames[-1][0] == key:
+            self.frames[-1][3] += 1
+        else:
+            self.frames.append([key, received, values, 1])
+        self.last = data
+        return True
+
+    def reading(self, now: datetime | None = None) -> dict[str, Any] | None:
+        """The last frame with the medians of the window, None without a frame."""
+        now = now if now else datetime.now()
+        while len(self.frames) > 0 and now - self.frames[0][1] > self.window:
+            self.frames.popleft()
+        if len(self.frames) == 0:
+            return None
+        data: dict[str, Any] = dict(self.last)
+        for metric in METRICS:
+            weighted: list[tuple[float, int]] = [(frame[2][metric], frame[3]) for frame in self.frames if
+                                                 frame[2][metric] is not None]
+            if len(weighted) > 0:
+                data[metric] = self.__robust_median(weighted, RTL_433_MAD_MIN[metric])
+        return data
+
+    def first(self) -> datetime | None:
+        return self.frames[0][1] if len(self.frames) > 0 else None
+
+    def size(self) -> int:
+        """Frames of the window, with their repeats."""
+        return sum(frame[3] for frame in self.frames)
+
+    @staticmethod
+    def __robust_median(weighted: list[tuple[float, int]], mad_min: float) -> float:
+        median: float = SensorWindow.__median(weighted)
+        mad: float = max(SensorWindow.__median([(abs(value - median), weight) for value, weight in weighted]), mad_min)
+        return SensorWindow.__median([(value, weight) for value, weight in weighted if
+                                      abs(value - median) <= RTL_433_MAD_K * mad])
+
+    @staticmethod
+    def __median(weighted: list[tuple[float, int]]) -> float:
+        weighted = sorted(weighted)
+        total: int = sum(weight for _, weight in weighted)
+        cumulative: int = 0
+        for i, (value, weight) in enumerate(weighted):
+            cumulative += weight
+            if cumulative * 2 > total:
+                return value
+            if cumulative * 2 == total:
+                return (value + weighted[i + 1][0]) / 2
+        return weighted[-1][0]
@@ -14,6 +14,8 @@ from matplotlib.widgets import CheckButtons
 
 import thermopro
 from thermopro import log
+from thermopro.ColumnarFile import ColumnarFile
+from thermopro.constants import SENSORS_COLUMNS_PATH
 
 
 class SensorsGraph:
@@ -23,7 +25,9 @@ class SensorsGraph:
         log.info('Starting ThermoProGraph')
         thermopro.sensors = None
         global df
-        df = thermopro.load_sensors()
+        df = ColumnarFile(SENSORS_COLUMNS_PATH).read(version=thermopro.get_sensors_store().read_manifest()['version'])
+        if df is None:
+            df = thermopro.load_sensors()
 
     def create_graph_sensors(self):
         try:
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+from collections.abc import Callable
+from datetime import datetime, timedelta
+from queue import Queue
+from typing import Any
+
+from thermopro import log
+from thermopro.Collector import Collector
+from thermopro.constants import SOURCE_CADENCES, SOURCE_TTLS
+
+
+# A source of the hourly row (rtl_433, Neviweb, OpenWeather, Hydro-Québec): collect() gives its values, the last ones
+# are kept with their time. Each source is polled on its own cadence (SOURCE_CADENCES) by ThermoProScan, and the
+# hourly row takes its last values while they are fresh (SOURCE_TTLS) instead of polling it again:
+# an expensive source is polled less often than every hour, a cheap one more often.
+# A poll giving nothing, or only empty groups like {'kwh_dict': {}}, failed: the last values stay those of the last good
+# poll. A source stays busy while the thread of its collect() runs, see in_thread(), even once the poll was cancelled.
+class Source:
+    name: str = ''
+
+    def __init__(self):
+        self.cadence: timedelta = timedelta(seconds=SOURCE_CADENCES.get(self.name, 60 * 60))
+        self.ttl: timedelta = timedelta(seconds=SOURCE_TTLS.get(self.name, 0))
+        self.latest: dict[str, Any] = {}
+        self.latest_time: datetime | None = None
+        self.polling: bool = False
+        self.threads: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    async def collect(self) -> dict[str, Any]:
+        raise NotImplementedError
+
+    async def poll(self) -> dict[str, Any]:
+        """collect(), or the values of the poll (or of the thread of a cancelled poll) running when it ends."""
+        with self.lock:
+            running: bool = self.busy()
+            # Only the poll running collect() is polling: a waiter waits on it, never on itself
+            if not running:
+                self.polling = True
+        if running:
+            while self.busy():
+                await asyncio.sleep(0.5)
+            with self.lock:
+                return dict(self.latest)
+        try:
+            result: dict[str, Any] = await self.collect()
+            if Source.failed(result):
+                log.warning(f'Source {self.name}: nothing collected, the last values are kept')
+            else:
+                with self.lock:
+                    self.latest, self.latest_time = result, datetime.now()
+            return result
+        finally:
+            self.polling = False
+
+    def busy(self) -> bool:
+        return self.polling or self.threads > 0
+
+    @staticmethod
+    def failed(result: dict[str, Any]) -> bool:
+        return all(isinstance(value, dict) and len(value) == 0 for value in result.values())
+
+    async def in_thread(self, function: Callable[[Queue], None]) -> dict[str, Any]:
+        """Collector.in_thread() for collect(): the source is busy until the thread ends, not until the poll ends."""
+        with self.lock:
+            self.threads += 1
+        return await Collector.in_thread(function, done=self.__thread_done)
+
+    def __thread_done(self) -> None:
+        with self.lock:
+            self.threads -= 1
+
+    async def get(self) -> dict[str, Any]:
+        """The last values if still fresh, else a poll."""
+        fresh: dict[str, Any] | None = self.fresh()
+        if fresh is not None:
+            log.info(f'Source {self.name}: values of {self.latest_time:%H:%M:%S} still fresh')
+            return fresh
+        return await self.poll()
+
+    def fresh(self, now: datetime | None = None) -> dict[str, Any] | None:
+        with self.lock:
+            if self.latest_time is None or (now if now else datetime.now()) - self.latest_time > self.ttl:
+                return None
+            return dict(self.latest)
@@ -6,7 +6,7 @@ import sys
 import tkinter
 import traceback
 from collections.abc import Sequence
-from datetime import timedelta
+from datetime import timedelta, datetime
 from typing import Any
 
 import matplotlib
@@ -22,11 +22,22 @@ from matplotlib.lines import Line2D
 from matplotlib.widgets import CheckButtons, Slider, Button
 
 import thermopro
-from constants import MIN_HPA, MAX_HPA, DAYS_PER_MONTH
+from constants import MIN_HPA, MAX_HPA, DAYS_PER_MONTH, THERMO_PRO_SCAN_COLUMNS_PATH
 from thermopro import log
+from thermopro.ColumnarFile import ColumnarFile
+from thermopro.Dataset import Dataset
+from thermopro.HistoryStore import HistoryStore
+from thermopro.Rollups import Rollups
 
 # from thermopro.Tooltip import Tooltip
 
+# Only the columns drawn by create_graph_temperature, create_graph_energy and clean_data are read from the store
+GRAPH_COLUMNS: list[str] = ['time', 'ext_temp', 'int_temp', 'open_temp', 'open_feels_like', 'ext_humidex',
+                            'ext_humidity', 'int_humidity', 'open_humidity', 'open_pressure', 'kwh_hydro_quebec',
+                            'kwh_neviweb']
+
+MEAN_COLUMNS: list[str] = ['ext_temp', 'int_temp', 'ext_humidity', 'int_humidity', 'kwh_hydro_quebec', 'kwh_neviweb']
+
 root = tkinter.Tk()
 SCREEN_WIDTH: int = root.winfo_screenwidth()
 SCREEN_HEIGHT: int = root.winfo_screenheight()
@@ -36,11 +47,17 @@ root.destroy()
 class ThermoProGraph:
     df: pd.DataFrame
 
-    def __init__(self):
-        log.info('Starting ThermoProGraph')
+    def __init__(self, start: datetime | None = None, dataset: Dataset | None = None):
+        log.info(f'Starting ThermoProGraph, from: {start}')
         thermopro.sensors = None
         global df
-        df = thermopro.load_json()
+        if dataset is not None:
+            df = dataset.get(columns=GRAPH_COLUMNS, start=start)
+        else:
+            df = ColumnarFile(THERMO_PRO_SCAN_COLUMNS_PATH).read(columns=GRAPH_COLUMNS, start=start,
+                                                                 version=HistoryStore().read_manifest()['version'])
+            if df is None:
+                df = thermopro.query(columns=GRAPH_COLUMNS, start=start)
         self.clean_data()
 
     def create_graph_temperature(self, show_window: bool) -> None:
@@ -51,6 +68,7 @@ class ThermoProGraph:
             self.clean_data()
 
             mean: float = DAYS_PER_MONTH
+            means: pd.DataFrame = self.rolling_mean(mean)
 
             fig, ax1 = plt.subplots()
             ax2 = ax1.twinx()
@@ -78,25 +96,25 @@ class ThermoProGraph:
                 f'{m_dates.num2date(sel.target[0]).strftime('%Y/%m/%d %H:00')}:  {int(float(sel[1][1]) * float((MAX_HPA - MIN_HPA) / 100.0) + MIN_HPA)} {sel[0].get_label()}'
             ))
 
-            mean_ext_temp, = ax2.plot(df["time"], df.rolling(window=f'{mean}D', on='time')['ext_temp'].mean(),
+            mean_ext_temp, = ax2.plot(means["time"], means['ext_temp'],
                                       color='xkcd:deep red', alpha=0.3, label='Mean ext °C')
             mplcursors.cursor(mean_ext_temp, hover=2).connect("add", lambda sel: sel.annotation.set_text(
                 f'{m_dates.num2date(sel.target[0]).strftime('%Y/%m/%d %H:00')}:  {round(float(sel[1][1]), 2)} {sel[0].get_label()}'
             ))
 
-            mean_int_temp, = ax2.plot(df["time"], df.rolling(window=f'{mean}D', on='time')['int_temp'].mean(),
+            mean_int_temp, = ax2.plot(means["time"], means['int_temp'],
                                       color='xkcd:deep rose', alpha=0.3, label='Mean int °C')
             mplcursors.cursor(mean_int_temp, hover=2).connect("add", lambda sel: sel.annotation.set_text(
                 f'{m_dates.num2date(sel.target[0]).strftime('%Y/%m/%d %H:00')}:  {round(float(sel[1][1]), 2)} {sel[0].get_label()}'
             ))
 
-            mean_ext_humidity, = ax1.plot(df["time"], df.rolling(window=f'{mean}D', on='time')['ext_humidity'].mean(),
+            mean_ext_humidity, = ax1.plot(means["time"], means['ext_humidity'],
                                           color='xkcd:deep blue', alpha=0.3, label='Mean ext %')
             mplcursors.cursor(mean_ext_humidity, hover=2).connect("add", lambda sel: sel.annotation.set_text(
                 f'{m_dates.num2date(sel.target[0]).strftime('%Y/%m/%d %H:00')}:  {round(float(sel[1][1]), 2)} {sel[0].get_label()}'
             ))
 
-            mean_int_humidity, = ax1.plot(df["time"], df.rolling(window=f'{mean}D', on='time')['int_humidity'].mean(),
+            mean_int_humidity, = ax1.plot(means["time"], means['int_humidity'],
                                           color='xkcd:dark blue', alpha=0.3, label='Mean int %')
             mplcursors.cursor(mean_int_humidity, hover=2).connect("add", lambda sel: sel.annotation.set_text(
                 f'{m_dates.num2date(sel.target[0]).strftime('%Y/%m/%d %H:00')}:  {round(float(sel[1][1]), 2)} {sel[0].get_label()}'
@@ -149,7 +167,7 @@ class ThermoProGraph:
                 plt.title(
                     f"Date: {df['time'][len(df['time']) - 1].strftime('%Y/%m/%d %H:%M')}, Int: {df['int_temp'][len(df['int_temp']) - 1]}°C, Ext.: {df['ext_temp'][len(df['ext_temp']) - 1]}°C, " \
                     + f"{int(df['ext_humidity'][len(df['ext_humidity']) - 1])}%, Humidex: {(df['ext_humidex'][len(df['ext_humidex']) - 1])}, " \
-                    + f"Open: {df['open_temp'][len(df['open_temp']) - 1]}°C, Open: {int(df['open_humidity'][len(df['open_humidity']) - 1])}%, Open Humidex: {int(df['open_feels_like'][len(df['open_feels_like']) - 1])}, " \
+                    + f"Open: {df['open_temp'][len(df['open_temp']) - 1]}°C, Open: {int(df['open_humidity'][len(df['open_humidity']) - 1])}%, Open Humidex: {df['open_feels_like'][len(df['open_feels_like']) - 1]:.0f}, " \
                     + f'Pressure: {int(df['open_pressure'][len(df['open_pressure']) - 1])} hPa', fontsize=10)
             except Exception as ex:
                 log.error(ex)
@@ -311,10 +329,11 @@ class ThermoProGraph:
                 fig.canvas.draw_idle()
 
             def on_changed_mean(val):
-                mean_ext_temp.set_data(df["time"], df.rolling(window=f'{val}D', on='time')['ext_temp'].mean())
-                mean_int_temp.set_data(df["time"], df.rolling(window=f'{val}D', on='time')['int_temp'].mean())
-                mean_ext_humidity.set_data(df["time"], df.rolling(window=f'{val}D', on='time')['ext_humidity'].mean())
-                mean_int_humidity.set_data(df["time"], df.rolling(window=f'{val}D', on='time')['int_humidity'].mean())
+                means = self.rolling_mean(val)
+                mean_ext_temp.set_data(means["time"], means['ext_temp'])
+                mean_int_temp.set_data(means["time"], means['int_temp'])
+                mean_ext_humidity.set_data(means["time"], means['ext_humidity'])
+                mean_int_humidity.set_data(means["time"], means['int_humidity'])
 
             slider_mean = Slider(
                 plt.axes(
@@ -370,6 +389,10 @@ class ThermoProGraph:
             log.error(traceback.format_exc())
             ctypes.windll.user32.MessageBoxW(0, f'{ex}', "ThermoProGraph Error", 16)
 
+    def rolling_mean(self, days: float) -> pd.DataFrame:
+        # Daily means over the last `days` days, read from the rollups instead of rolling over every hourly row
+        return Rollups().rolling_mean(MEAN_COLUMNS, days, start=df['time'][0])
+
     def clean_data(self):
         df['ext_humidity'] = df['ext_humidity'].apply(lambda x: None if x == 0 else x)
         df['int_humidity'] = df['int_humidity'].apply(lambda x: None if x == 0 else x)
@@ -387,6 +410,7 @@ class ThermoProGraph:
             self.clean_data()
 
             mean: int = DAYS_PER_MONTH
+            means: pd.DataFrame = self.rolling_mean(mean)
 
             fig, ax1 = plt.subplots()
             ax2 = ax1.twinx()
@@ -414,14 +438,14 @@ class ThermoProGraph:
             ax2.set_ylabel('Temperature °C', color='xkcd:scarlet')
             ax2.grid(axis='y', linewidth=0.2, color='xkcd:scarlet')
 
-            mean_ext_temp, = ax2.plot(df["time"], df.rolling(window=f'{mean}D', on='time')['ext_temp'].mean(),
+            mean_ext_temp, = ax2.plot(means["time"], means['ext_temp'],
                                       color='xkcd:deep red', alpha=0.3, label='Mean ext °C')
-            mean_int_temp, = ax2.plot(df["time"], df.rolling(window=f'{mean}D', on='time')['int_temp'].mean(),
+            mean_int_temp, = ax2.plot(means["time"], means['int_temp'],
                                       color='xkcd:deep rose', alpha=0.3, label='Mean int °C')
-            mean_kwh_hydro_quebec, = ax1.plot(df["time"],
-                                              df.rolling(window=f'{mean}D', on='time')['kwh_hydro_quebec'].mean(),
+            mean_kwh_hydro_quebec, = ax1.plot(means["time"],
+                                              means['kwh_hydro_quebec'],
                                               color='xkcd:medium grey', alpha=0.3, label='Mean Hydo KWh')
-            mean_kwh_neviweb, = ax1.plot(df["time"], df.rolling(window=f'{mean}D', on='time')['kwh_neviweb'].mean(),
+            mean_kwh_neviweb, = ax1.plot(means["time"], means['kwh_neviweb'],
                                          color='xkcd:charcoal', alpha=0.3, label='Mean Nevi KWh')
 
             plt.axhline(0, linewidth=0.5, color='black', zorder=-10)
@@ -429,10 +453,10 @@ class ThermoProGraph:
             try:
                 plt.title(
                     f"Date: {df['time'][len(df['time']) - 1].strftime('%Y/%m/%d %H:%M')}, " \
-                    + f"Mean Int: {round(df.rolling(window=f'{mean}D', on='time')['int_temp'].mean()[len(df['int_temp']) - 1], 2)}°C, " \
-                    + f"Mean Ext.: {round(df.rolling(window=f'{mean}D', on='time')['ext_temp'].mean()[len(df['ext_temp']) - 1])}°C, " \
-                    + f"Mean Hydro: {round(df.rolling(window=f'{mean}D', on='time')['kwh_hydro_quebec'].mean()[len(df['kwh_hydro_quebec']) - 1], 2)}KWh, " \
-                    + f"Mean Nevi: {round(df.rolling(window=f'{mean}D', on='time')['kwh_neviweb'].mean()[len(df['kwh_neviweb']) - 1], 2)}KWh",
+                    + f"Mean Int: {round(means['int_temp'].iloc[-1], 2)}°C, " \
+                    + f"Mean Ext.: {round(means['ext_temp'].iloc[-1])}°C, " \
+                    + f"Mean Hydro: {round(means['kwh_hydro_quebec'].iloc[-1], 2)}KWh, " \
+                    + f"Mean Nevi: {round(means['kwh_neviweb'].iloc[-1], 2)}KWh",
                     fontsize=10)
             except Exception as ex:
                 log.error(ex)
@@ -599,11 +623,12 @@ class ThermoProGraph:
                 fig.canvas.draw_idle()
 
             def on_changed_mean(val):
-                mean_ext_temp.set_data(df["time"], df.rolling(window=f'{val}D', on='time')['ext_temp'].mean())
-                mean_int_temp.set_data(df["time"], df.rolling(window=f'{val}D', on='time')['int_temp'].mean())
-                mean_kwh_hydro_quebec.set_data(df["time"],
-                                               df.rolling(window=f'{val}D', on='time')['kwh_hydro_quebec'].mean())
-                mean_kwh_neviweb.set_data(df["time"], df.rolling(window=f'{val}D', on='time')['kwh_neviweb'].mean())
+                means = self.rolling_mean(val)
+                mean_ext_temp.set_data(means["time"], means['ext_temp'])
+                mean_int_temp.set_data(means["time"], means['int_temp'])
+                mean_kwh_hydro_quebec.set_data(means["time"],
+                                               means['kwh_hydro_quebec'])
+                mean_kwh_neviweb.set_data(means["time"], means['kwh_neviweb'])
 
             slider_mean = Slider(
                 plt.axes(
@@ -691,12 +716,14 @@ class ThermoProGraph:
 
 if __name__ == '__main__':
     thermopro.set_up(__file__)
-    thermoProGraph: ThermoProGraph = ThermoProGraph()
+    # Optional second argument: number of days to show, only the months overlapping them are loaded
+    days: int | None = int(sys.argv[2]) if len(sys.argv) == 3 else None
+    thermoProGraph: ThermoProGraph = ThermoProGraph(start=datetime.now() - timedelta(days=days) if days else None)
 
     # thermoProGraph.create_graph_energy(show_window=True)
     # exit()
 
-    if len(sys.argv) == 2:
+    if len(sys.argv) >= 2:
         arg = sys.argv[1]
         log.info(f"The command line argument is: {arg}")
         if arg == 'temperature':
@@ -6,22 +6,24 @@ import statistics
 import sys
 import threading
 import traceback
-from datetime import datetime
-from queue import Queue
+from datetime import datetime, timedelta
 from time import sleep
 from typing import Any
 
 import pandas as pd
 import schedule
+from dateutil.relativedelta import relativedelta
 from pandas import DataFrame
 
 import thermopro
-from constants import COLUMNS
+from constants import COLUMNS, RTL_433_DAEMON
 from thermopro import log, show_df
+from thermopro.Collector import Collector
 from thermopro.HydroQuébecPower import HydroQuébec
 from thermopro.NeviwebTemperature import NeviwebTemperature
 from thermopro.OpenWeather import OpenWeather
 from thermopro.Rtl433Temperature2 import Rtl433Temperature2
+from thermopro.Source import Source
 from thermopro.ThermoProGraph import ThermoProGraph
 
 
@@ -30,96 +32,133 @@ class ThermoProScan:
     def __init__(self):
         log.info('Starting ThermoProScan')
         atexit.register(self.__cleanup_function)
+        # The last row committed by __call_all, patched by the late sources
+        self.row: dict[str, Any] = {}
+        self.kwh_dict: dict[str, float] = {}
+        self.sensors: dict[str, int | float | datetime] = {}
+        # Kept from scan to scan with their last values, see Source
+        self.sources: list[Source] = [Rtl433Temperature2(), NeviwebTemperature(), OpenWeather(), HydroQuébec()]
 
     def __call_all(self) -> None:
         log.warning(' Start __call_all '.center(100, '*'))
         now: datetime = datetime.now().replace(second=0, microsecond=0)
         thermopro.sensors = None
-        json_data: dict[str, Any] = {}
-        threads: list[threading.Thread] = []
-        result_queue: Queue = Queue()
         try:
-            thread: threading.Thread = threading.Thread(target=Rtl433Temperature2().call_rtl_433, args=(result_queue,))
-            threads.append(thread)
-            thread.start()
-
-            thread: threading.Thread = threading.Thread(target=NeviwebTemperature().load_neviweb, args=(result_queue,))
-            threads.append(thread)
-            thread.start()
-
-            thread: threading.Thread = threading.Thread(target=OpenWeather().load_open_weather, args=(result_queue,))
-            threads.append(thread)
-            thread.start()
-
-            thread: threading.Thread = threading.Thread(target=HydroQuébec().start, args=(result_queue,))
-            threads.append(thread)
-            thread.start()
-
-            for thread in threads:
-                thread.join()
-
-            while not result_queue.empty():
-                json_data.update(result_queue.get())
-
-            sensors1: dict[str, int | float | datetime] = json_data['sensors']
-            sensors2: dict[str, int | float | datetime] = dict(sensors1)
-            sensors1.update(json_data)
-            json_result: dict[str, int | float | str | None] = self.__get_means_and_mins(sensors1)
-            json_data.update(json_result)
-
-            kwh_dict: dict[str, float] = json_data['kwh_dict']
-
-            for col in list(json_data.keys()):
-                if col not in COLUMNS:
-                    try:
-                        del json_data[col]
-                    except KeyError as ke:
-                        log.warning(ke)
-
-            log.info(f'Got all new data:\n{json.dumps(json_data, indent=4, sort_keys=True, default=str)}')
-
-            df1: DataFrame = thermopro.load_json()
-            if json_data:
-                data_dict: dict[str, Any] = {}
-                for col in COLUMNS:
-                    if col == 'time':
-                        data_dict[col] = now
-                    elif type(json_data.get(col)) == datetime:
-                        data_dict[col] = json_data.get(col).strftime('%Y/%m/%d %H:%M:%S')
-                    elif type(json_data.get(col)) == float and pd.isna(json_data.get(col)):
-                        pass
-                    elif json_data.get(col) is None:
-                        pass
-                    else:
-                        if type(json_data.get(col)) == float:
-                            data_dict[col] = round(json_data.get(col), 2)
-                        elif type(json_data.get(col)) == int:
-                            data_dict[col] = int(json_data.get(col))
-                        else:
-                            data_dict[col] = json_data.get(col)
-
-                new_row_df = pd.DataFrame([data_dict])
+            Collector({source.name: source.get for source in self.sources}).run(
+                commit=lambda json_data: self.__commit(now, json_data),
+                patch=lambda json_data: self.__patch(now, json_data)
+            )
+        except Exception as ex:
+            log.fatal(ex)
+            log.fatal(traceback.format_exc())
+
+        thermopro.display_schedule()
+        log.warning(f' End __call_all Elapsed: {datetime.now().now() - now} '.center(100, '*'))
+
+    def __commit(self, now: datetime, json_data: dict[str, Any]) -> None:
+        """The row of now, with the sources in by their deadline."""
+        try:
+            self.row = self.__get_row(now, json_data)
+
+            df1: DataFrame = thermopro.get_dataset().get(start=now - relativedelta(days=1))
+            if self.row:
+                new_row_df = pd.DataFrame([self.row])
                 df1 = pd.concat([df1, new_row_df], ignore_index=True)
 
                 for col in ['time', 'open_sunrise', 'open_sunset']:
                     df1 = df1.astype({col: 'datetime64[ns]'})
 
-            self.set_kwh(kwh_dict, df1)
-            thermopro.set_astype(df1)
-            thermopro.save_json(df1)
-            thermopro.save_sensors(now, sensors2)
+            if self.row:
+                thermopro.append_json(df1.iloc[[len(df1) - 1]])
+            self.__upsert_kwh(now, json_data.get('kwh_dict', {}))
+            self.sensors = dict(json_data.get('sensors', {}))
+            thermopro.save_sensors(now, self.sensors)
 
-            thermoProGraph: ThermoProGraph = ThermoProGraph()
-            thermoProGraph.create_graph_energy(show_window=False)
-            thermoProGraph.create_graph_temperature(show_window=False)
+            self.__create_graphs()
 
             show_df(df1, title='__call_all')
         except Exception as ex:
             log.fatal(ex)
             log.fatal(traceback.format_exc())
 
-        thermopro.display_schedule()
-        log.warning(f' End __call_all Elapsed: {datetime.now().now() - now} '.center(100, '*'))
+    def __patch(self, now: datetime, json_data: dict[str, Any]) -> None:
+        """A source answered after its deadline: only the cells of the row it changes are written."""
+        try:
+            row: dict[str, Any] = self.__get_row(now, json_data)
+            changed: dict[str, Any] = {col: value for col, value in row.items() if self.row.get(col) != value}
+            if changed:
+                df: DataFrame = pd.DataFrame([{'time': now} | changed])
+                for col in [col for col in ['time', 'open_sunrise', 'open_sunset'] if col in df.columns]:
+                    df = df.astype({col: 'datetime64[ns]'})
+                thermopro.append_json(df)
+                log.info(f'Row of {now} patched: {sorted(changed.keys())}')
+            self.row = row
+
+            kwh_dict: dict[str, float] = json_data.get('kwh_dict', {})
+            kwh_changed: bool = kwh_dict != self.kwh_dict
+            if kwh_changed:
+                self.__upsert_kwh(now, kwh_dict)
+            sensors: dict[str, int | float | datetime] = dict(json_data.get('sensors', {}))
+            if sensors != self.sensors:
+                thermopro.save_sensors(now, sensors)
+                self.sensors = sensors
+
+            # The late cells were gaps of the graphs until now
+            if changed or kwh_changed:
+                self.__create_graphs()
+        except Exception as ex:
+            log.error(ex)
+            log.error(traceback.format_exc())
+
+    def __upsert_kwh(self, now: datetime, kwh_dict: dict[str, float]) -> None:
+        """kwh_hydro_quebec of the hours of the store from the first day of kwh_dict, of the last day without it."""
+        start_date: datetime = (datetime.strptime(sorted(kwh_dict.keys())[0][0:10], "%Y-%m-%d") if kwh_dict
+                                else now - relativedelta(days=1))
+        thermopro.upsert_json('kwh_hydro_quebec',
+                              self.get_kwh(kwh_dict, thermopro.get_dataset().get(start=start_date)))
+        self.kwh_dict = kwh_dict
+
+    def __create_graphs(self) -> None:
+        thermoProGraph: ThermoProGraph = ThermoProGraph(dataset=thermopro.get_dataset())
+        thermoProGraph.create_graph_energy(show_window=False)
+        thermoProGraph.create_graph_temperature(show_window=False)
+
+    def __get_row(self, now: datetime, json_data: dict[str, Any]) -> dict[str, Any]:
+        json_data = dict(json_data)
+        sensors1: dict[str, int | float | datetime] = dict(json_data.get('sensors', {}))
+        sensors1.update(json_data)
+        json_result: dict[str, int | float | str | None] = self.__get_means_and_mins(sensors1)
+        json_data.update(json_result)
+
+        # A new Neviweb group is a new column of the store from this row on
+        for col in list(json_data.keys()):
+            if thermopro.column_dtype(col) is None or isinstance(json_data[col], (dict, list)):
+                try:
+                    del json_data[col]
+                except KeyError as ke:
+                    log.warning(ke)
+
+        log.info(f'Got all new data:\n{json.dumps(json_data, indent=4, sort_keys=True, default=str)}')
+
+        data_dict: dict[str, Any] = {}
+        if json_data:
+            for col in COLUMNS + sorted(col for col in json_data if col not in COLUMNS):
+                if col == 'time':
+                    data_dict[col] = now
+                elif type(json_data.get(col)) == datetime:
+                    data_dict[col] = json_data.get(col).strftime('%Y/%m/%d %H:%M:%S')
+                elif type(json_data.get(col)) == float and pd.isna(json_data.get(col)):
+                    pass
+                elif json_data.get(col) is None:
+                    pass
+                else:
+                    if type(json_data.get(col)) == float:
+                        data_dict[col] = round(json_data.get(col), 2)
+                    elif type(json_data.get(col)) == int:
+                        data_dict[col] = int(json_data.get(col))
+                    else:
+                        data_dict[col] = json_data.get(col)
+        return data_dict
 
     def __get_means_and_mins(self, json_data: dict[str, int | float | datetime]) -> dict[str, int | float | str | None]:
         json_result: dict[str, int | float | str | None] = {}
@@ -127,24 +166,24 @@ class ThermoProScan:
         for entry in [s for s in list(json_data) if "ext_temp_" in s]:
             ext_temperature_list.append(json_data.get(entry)) if not pd.isnull(json_data.get(entry)) else None
         ext_temp: float | None = round(min(ext_temperature_list), 2) if len(ext_temperature_list) > 0 else None
-        json_result['ext_temp'] = ext_temp if ext_temp else 0.0
+        json_result['ext_temp'] = ext_temp
 
         room_temperature_list: list[float] = []
         for entry in [s for s in list(json_data) if "int_temp_" in s]:
             room_temperature_list.append(json_data.get(entry)) if not pd.isnull(json_data.get(entry)) else None
         int_temp: float = round(statistics.mean(room_temperature_list), 2) if len(room_temperature_list) > 0 else None
-        json_result['int_temp'] = int_temp if int_temp else 0.0
+        json_result['int_temp'] = int_temp
 
         ext_humidity_list: list[int] = []
         for entry in [s for s in list(json_data) if "ext_humidity_" in s]:
             ext_humidity_list.append(json_data.get(entry)) if not pd.isnull(json_data.get(entry)) else None
         ext_humidity: float = round(statistics.mean(ext_humidity_list), 2) if len(ext_humidity_list) > 0 else None
-        json_result['ext_humidity'] = ext_humidity if ext_humidity else 0
+        json_result['ext_humidity'] = ext_humidity
 
         room_humidity_list: list[int | None] = []
         for entry in [s for s in list(json_data) if "int_humidity_" in s]:
             room_humidity_list.append(json_data.get(entry)) if not pd.isnull(json_data.get(entry)) else None
-        int_humidity: float = round(statistics.mean(room_humidity_list), 2) if len(room_humidity_list) > 0 else 0
+        int_humidity: float | None = round(statistics.mean(room_humidity_list), 2) if len(room_humidity_list) > 0 else None
 
         json_result['int_humidity'] = int_humidity
         json_result['ext_humidex'] = self.__get_humidex(json_result['ext_temp'], json_result['ext_humidity'])
@@ -166,27 +205,25 @@ class ThermoProScan:
             log.error(traceback.format_exc())
         return json_result
 
-    def set_kwh(self, kwh_dict: dict[str, float], df: DataFrame) -> None:
+    def get_kwh(self, kwh_dict: dict[str, float], df: DataFrame) -> pd.Series:
+        """Hydro-Québec kWh of every hour from the first day of kwh_dict, 0.0 for the hours it does not have."""
+        kwh: pd.Series = pd.Series(dtype='float64')
         try:
             if kwh_dict:
                 keys: list[str] = sorted(kwh_dict.keys())
-                start_date = datetime.strptime(keys[0][0:10], "%Y-%m-%d")
-                end_date = datetime.now()
                 log.info(
                     f'Setting hydro KWH, kwh_list size: {len(keys)}, first: {keys[0][0:10]}, last: {keys[len(keys) - 1][0:10]}')
-                filtered_df = df.loc[(df['time'] >= start_date) & (df['time'] <= end_date)]
-                filtered_df['time'].astype('datetime64[ns]')
-                filtered_df.set_index('time')
-                filtered_df = filtered_df.sort_values(by='time', ascending=True)
-                log.info(f'DataFrame size: {len(filtered_df)}')
-
-                for index, line1 in filtered_df.iterrows():
-                    key = f'{line1['time'].strftime('%Y-%m-%d')} {line1['time'].strftime('%H')}'
-                    kwh: float = kwh_dict.get(key) if kwh_dict.get(key) else 0.0
-                    df.loc[index, 'kwh_hydro_quebec'] = kwh
+                kwh = pd.Series(kwh_dict, dtype='float64')
+                kwh.index = pd.to_datetime(kwh.index, format='%Y-%m-%d %H')
+                times: pd.Series = pd.to_datetime(df['time'])
+                hours: pd.DatetimeIndex = pd.DatetimeIndex(
+                    times[(times >= kwh.index.min().normalize()) & (times <= datetime.now())].dt.floor('h').unique())
+                kwh = kwh.reindex(hours.union(kwh.index)).fillna(0.0)
+                log.info(f'{len(kwh)} hours')
         except Exception as ex:
             log.error(ex)
             log.error(traceback.format_exc())
+        return kwh
 
     def __get_humidex(self, temp: float, humidity: int) -> int | None:
         if temp is not None and humidity is not None:
@@ -203,6 +240,17 @@ class ThermoProScan:
         try:
             self.set_frequency(4)
             schedule.every().hour.at(":01").do(self.__call_all)
+            # The sources polled more often than the hourly row, in their own thread so a slow poll never delays a scan
+            for source in [source for source in self.sources if source.cadence < timedelta(hours=1)]:
+                schedule.every(int(source.cadence.total_seconds())).seconds.do(
+                    lambda source=source: threading.Thread(target=self.__poll, args=(source,), name=source.name,
+                                                           daemon=True).start())
+            # Away from the hourly scan, and in its own thread so a long compaction never delays a scan
+            schedule.every().day.at("03:31").do(
+                lambda: threading.Thread(target=thermopro.compact, name='compact', daemon=True).start())
+
+            if RTL_433_DAEMON:
+                self.__get_rtl_433().daemon.start()
 
             self.__call_all()
             # thermopro.copy_to_cloud()
@@ -217,6 +265,16 @@ class ThermoProScan:
             log.error(traceback.format_exc())
             self.__cleanup_function()
 
+    def __get_rtl_433(self) -> Rtl433Temperature2:
+        return next(source for source in self.sources if isinstance(source, Rtl433Temperature2))
+
+    def __poll(self, source: Source) -> None:
+        try:
+            Collector({source.name: source.poll}).run()
+        except Exception as ex:
+            log.error(ex)
+            log.error(traceback.format_exc())
+
     def set_frequency(self, frequency_per_day: int = 4):
         log.info(f'Creating schedule at: {frequency_per_day} per day')
         values: dict[int, int] = {1: 24, 2: 12, 3: 8, 4: 6, 6: 4, 8: 3, 12: 2, 24: 1}
@@ -231,6 +289,7 @@ class ThermoProScan:
         try:
             log.info('ThermoProScan stopping...')
             schedule.clear()
+            self.__get_rtl_433().daemon.stop()
             log.info('ThermoProScan stopped')
             sys.exit()
         except SystemExit as ex:
@@ -13,6 +13,7 @@ from pandas import DataFrame
 
 import thermopro
 from thermopro import log
+from thermopro.Rollups import Rollups
 from thermopro.constants import DAYS_PER_MONTH
 
 COMFORT_MATRIX = '''%,21,22,23,24,25,26,27,28,29,30,31,32,33,34,35,36,37,38,39,40,41,42,43
@@ -137,6 +138,12 @@ HTML = '''
 WIDTH: int = 340
 HEIGHT: int = 400
 
+TOOLTIP_COLUMNS: list[str] = ['time', 'open_icon', 'ext_temp', 'ext_humidex', 'open_feels_like', 'open_description',
+                              'open_rain', 'open_snow', 'open_wind_speed', 'open_wind_gust', 'open_wind_deg',
+                              'ext_humidity', 'open_pressure', 'open_visibility', 'open_uvi', 'kwh_hydro_quebec',
+                              'kwh_neviweb', 'int_temp', 'int_humidity', 'int_temp_bureau', 'int_temp_chambre',
+                              'int_temp_salle-de-bain', 'int_temp_salon']
+
 
 class Tooltip:
 
@@ -182,11 +189,13 @@ class Tooltip:
 
             data['open_wind_deg_txt'] = self.degToCompass(data.get('open_wind_deg')) if data.get('open_wind_deg') else ''
             data['int_temp_salle_de_bain'] = data['int_temp_salle-de-bain']
-            comfort = self.get_matrix(int(data.get('int_temp')), data.get('int_humidity'))
+            comfort = self.get_matrix(int(data.get('int_temp')) if not math.isnan(data.get('int_temp')) else 0,
+                                      data.get('int_humidity'))
             print(comfort)
             data['comfort_color'] = comfort[0]
             data['comfort_text'] = comfort[1]
-            data['mean_kwh_hydro_quebec'] = round(df.rolling(window=f'{mean}D', on='time')['kwh_hydro_quebec'].mean().iloc[-1], 3)
+            means: DataFrame = Rollups().rolling_mean(['kwh_hydro_quebec'], mean, start=df['time'].iloc[-1])
+            data['mean_kwh_hydro_quebec'] = round(means['kwh_hydro_quebec'].iloc[-1], 3)
             data['int_humidity'] = data['int_humidity'] if not math.isnan(data.get('int_humidity')) else 0
             data['open_rain'] = data['open_rain'] if not data.get('open_rain') is None else 0.0
             data['open_snow'] = data['open_snow'] if not data.get('open_snow') is None else 0.0
@@ -215,4 +224,4 @@ if __name__ == '__main__':
     SCREEN_HEIGHT: int = root.winfo_screenheight()
     root.destroy()
     tooltip: Tooltip = Tooltip()
-    tooltip.render(thermopro.load_json(), 20434.166062978064, 2323, 1327, SCREEN_WIDTH, SCREEN_HEIGHT, DAYS_PER_MONTH)
+    tooltip.render(thermopro.query(columns=TOOLTIP_COLUMNS), 20434.166062978064, 2323, 1327, SCREEN_WIDTH, SCREEN_HEIGHT, DAYS_PER_MONTH)
@@ -0,0 +1,97 @@
+import json
+import math
+import os
+import threading
+import traceback
+from collections import deque
+from datetime import datetime
+
+from constants import (TRANSMIT_SCHEDULE_FILE, RTL_433_BURST, RTL_433_LEAD, RTL_433_LATE_PERIODS, RTL_433_WINDOW_SIZE,
+                       SOURCE_CADENCES)
+from thermopro import log
+from thermopro.HistoryStore import HistoryStore
+
+
+# Arrivals of the transmissions of each sensor (the first frame of a burst), in TRANSMIT_SCHEDULE_FILE: a sensor
+# transmits on a fixed period, its next transmission is its last arrival plus a whole number of periods.
+# The period comes from the intervals between arrivals: the shortest one is about one period (or a few when some were
+# missed), each longer one divided by its number of periods refines it. The arrivals of the captures, a cadence apart,
+# make it precise once it is known. A sensor heard once per capture only gives intervals of about the cadence of the
+# captures, not its own period: the period stays unknown until two arrivals fall within half a cadence, the capture
+# listens for the next burst of a sensor until then. Unknown means no waiting and no late.
+class TransmitSchedule:
+
+    def __init__(self, file: str = TRANSMIT_SCHEDULE_FILE):
+        self.file: str = file
+        self.lock: threading.Lock = threading.Lock()
+        self.arrivals: dict[str, deque[float]] = {}
+        try:
+            if os.path.isfile(file):
+                with open(file, 'r') as json_file:
+                    self.arrivals = {model: deque(times, maxlen=RTL_433_WINDOW_SIZE) for model, times in
+                                     json.load(json_file).items()}
+        except Exception as ex:
+            log.error(ex)
+            log.error(traceback.format_exc())
+
+    def arrive(self, model: str, when: datetime | None = None) -> None:
+        """A frame of model: an arrival, unless a repeat of the burst of the last one."""
+        when_ts: float = (when if when else datetime.now()).timestamp()
+        with self.lock:
+            times: deque[float] = self.arrivals.setdefault(model, deque(maxlen=RTL_433_WINDOW_SIZE))
+            if len(times) == 0 or when_ts - times[-1] > RTL_433_BURST:
+                times.append(when_ts)
+
+    def period(self, model: str) -> float | None:
+        with self.lock:
+            times: list[float] = list(self.arrivals.get(model, []))
+        intervals: list[float] = [b - a for a, b in zip(times, times[1:]) if b - a > RTL_433_BURST]
+        if len(intervals) == 0 or min(intervals) >= SOURCE_CADENCES.get('rtl_433', 60 * 60) / 2:
+            return None
+        # From the shortest interval up: each one counted in periods of the estimate of the shorter ones
+        period: float = min(intervals)
+        total: float = 0
+        periods: int = 0
+        for interval in sorted(intervals):
+            total += interval
+            periods += max(round(interval / period), 1)
+            period = total / periods
+        return period
+
+    def next(self, model: str, after: datetime) -> datetime | None:
+        """The first transmission of model expected at or after after."""
+        period: float | None = self.period(model)
+        if period is None:
+            return None
+        last: float = self.arrivals[model][-1]
+        return datetime.fromtimestamp(last + max(math.ceil((after.timestamp() - last) / period), 0) * period)
+
+    def wait(self, models: list[str], now: datetime | None = None) -> float:
+        """Seconds before rtl_433 has to listen for models: RTL_433_LEAD before the first one expected, 0 when the
+        schedule of one of them is unknown."""
+        now = now if now else datetime.now()
+        expected: list[datetime | None] = [self.next(model, now) for model in models]
+        if len(expected) == 0 or None in expected:
+            return 0
+        return max((min(expected) - now).total_seconds() - RTL_433_LEAD, 0)
+
+    def late(self, models: list[str], since: datetime, now: datetime | None = None) -> dict[str, float]:
+        """The models not heard RTL_433_LATE_PERIODS periods after they were expected, listening since since: the
+        seconds since they were expected."""
+        now = now if now else datetime.now()
+        late: dict[str, float] = {}
+        for model in models:
+            period: float | None = self.period(model)
+            expected: datetime | None = self.next(model, since)
+            if period is not None and (now - expected).total_seconds() > RTL_433_LATE_PERIODS * period:
+                late[model] = (now - expected).total_seconds()
+        return late
+
+    def save(self) -> None:
+        with self.lock:
+            text: str = json.dumps({model: list(times) for model, times in self.arrivals.items()}, indent=4)
+        try:
+            HistoryStore.publish(self.file, text)
+        except Exception as ex:
+            log.error(ex)
+            log.error(traceback.format_exc())
@@ -9,6 +9,7 @@ import tkinter
 import tkinter as tk
 import traceback
 import zipfile
+from collections.abc import Iterator
 from datetime import datetime
 from pathlib import Path
 
@@ -23,9 +24,17 @@ from pandas import DataFrame
 import thermopro
 from thermopro.constants import COLUMNS, THERMO_PRO_SCAN_OUTPUT_JSON_FILE, LOG_PATH, HOME_PATH, TIMEOUT, \
     POIDS_PRESSION_PATH, SENSORS_OUTPUT_JSON_FILE, DAYS_PER_MONTH, RTL_433_EXE_PATH, OUTPUT_RTL_433_FILE, BKP_SCRIPTS, \
-    CLOUD_PATHS, ROBOCOPY_RETURNCODES, BKP_PATH, BKP_DAYS
+    CLOUD_PATHS, ROBOCOPY_RETURNCODES, BKP_PATH, BKP_DAYS, THERMO_PRO_SCAN_STORE_PATH, SCHEMA, SENSORS_STORE_PATH, \
+    SENSORS_KEYS, SENSOR_METRICS, RETENTION_POLICIES, THERMO_PRO_SCAN_COLUMNS_PATH, SENSORS_COLUMNS_PATH, DYNAMIC_COLUMNS
+from thermopro.Codec import Codec
+from thermopro.ColumnarFile import ColumnarFile
+from thermopro.HistoryStore import HistoryStore
+from thermopro.JsonRecordsReader import JsonRecordsReader
+from thermopro.Rollups import Rollups
+from thermopro.Dataset import Dataset
 
 sensors: dict[str, dict[str, list[str]] | dict[str, str | None]]
+dataset: Dataset | None = None
 
 
 def save_window(fig: Figure, image_name: str) -> None:
@@ -79,124 +88,176 @@ def get_sensors() -> dict[str, dict[str, list[str]] | dict[str, str | None]]:
     return sensors
 
 
-def save_sensors(now: datetime, sensors: dict[str, int | float | datetime]) -> None:
-    try:
-        sensors['time'] = now
-        df_sensors: DataFrame = pd.DataFrame([sensors])
-        df_sensors = df_sensors.astype({'time': 'datetime64[ns]'})
+def get_dataset() -> Dataset:
+    global dataset
+    if dataset is None:
+        dataset = Dataset()
+    return dataset
 
-        df_in: DataFrame | None = load_sensors()
-        if df_in is not None:
-            df_in = pd.concat([df_in, df_sensors], ignore_index=True)
 
-            df_in = df_in[['time'] + [c for c in sorted(df_in.columns) if c != 'time']]
+def get_sensor_ids(names: list[str] | None = None) -> dict[str, int]:
+    ids_file: str = f'{SENSORS_STORE_PATH}/sensor_ids.json'
+    ids: dict[str, int] = {}
+    if os.path.exists(ids_file):
+        with open(ids_file, 'r') as file:
+            ids = json.load(file)
 
-            df_in.to_json(SENSORS_OUTPUT_JSON_FILE, orient='records', indent=4, date_format='iso',
-                          compression={
-                              'method': 'zip',
-                              'compression': zipfile.ZIP_LZMA,
-                              'compresslevel': 9
-                          })
+    new_names: list[str] = []
+    for name in [name for freq in get_sensors() for name in get_sensors()[freq]['sensors']] + (names if names else []):
+        if name not in ids and name not in new_names:
+            new_names.append(name)
+    if len(new_names) > 0:
+        for name in new_names:
+            ids[name] = max(ids.values(), default=0) + 1
+        os.makedirs(SENSORS_STORE_PATH, exist_ok=True)
+        # At once, like the manifests: a crash never leaves a half written id map
+        HistoryStore.publish(ids_file, json.dumps(ids, indent=4))
+        log.info(f'New sensor ids: {[f'{name}: {ids[name]}' for name in new_names]}')
+    return ids
 
-            show_df(df_in, title='save_sensors', max_rows=10)
-            log.info(f'File of Sensors "{SENSORS_OUTPUT_JSON_FILE}" is saved.')
-        else:
-            log.warning('df_in is None')
+
+def save_sensors(now: datetime, sensors: dict[str, int | float | datetime]) -> None:
+    try:
+        readings: list[tuple[list[str], int | float | datetime]] = [
+            (parts, value) for key, value in sensors.items() if
+            len(parts := key.split('_', 2)) == 3 and f'{parts[0]}_{parts[1]}' in SENSOR_METRICS]
+        # A sensor seen for the first time gets its id, nothing else changes in the store
+        ids: dict[str, int] = get_sensor_ids(sorted({parts[2] for parts, _ in readings}))
+        rows: list[dict[str, int | float | datetime]] = []
+        for parts, value in readings:
+            if value is not None and not pd.isna(value):
+                rows.append({'time': now, 'sensor_id': ids[parts[2]],
+                             'metric': SENSOR_METRICS.index(f'{parts[0]}_{parts[1]}'), 'value': float(value)})
+
+        df_sensors: DataFrame = pd.DataFrame(rows, columns=SENSORS_KEYS + ['value'])
+        df_sensors = df_sensors.astype({'time': 'datetime64[ns]'})
+        get_sensors_store().append(df_sensors)
+        update_sensors_columns(df_sensors)
+        show_df(df_sensors, title='save_sensors', max_rows=10)
+        log.info(f'Store of Sensors "{SENSORS_STORE_PATH}" is saved, {len(df_sensors)} readings.')
     except Exception as ex:
         log.error(ex)
         log.error(traceback.format_exc())
 
 
-def load_sensors() -> DataFrame | None:
+def get_sensors_store() -> HistoryStore:
+    store: HistoryStore = HistoryStore(SENSORS_STORE_PATH, keys=SENSORS_KEYS)
+    if not store.exists() and os.path.exists(SENSORS_OUTPUT_JSON_FILE):
+        log.warning(f'Store {SENSORS_STORE_PATH} not found, migrating {SENSORS_OUTPUT_JSON_FILE}')
+        store.write(sensors_long(df_in) for df_in in
+                    JsonRecordsReader(SENSORS_OUTPUT_JSON_FILE, dtypes={'time': 'datetime64[ns]'}).chunks())
+    return store
+
+
+def sensors_long(df_in: DataFrame) -> DataFrame:
+    df_long: DataFrame = df_in.melt(id_vars='time', var_name='column', value_name='value').dropna(subset=['value'])
+    parts: DataFrame = df_long['column'].str.split('_', n=2, expand=True)
+    df_long['metric'] = (parts[0] + '_' + parts[1]).map({metric: i for i, metric in enumerate(SENSOR_METRICS)})
+    df_long = df_long[df_long['metric'].notna()]
+    ids: dict[str, int] = get_sensor_ids(sorted(parts.loc[df_long.index, 2].unique().tolist()))
+    df_long['sensor_id'] = parts.loc[df_long.index, 2].map(ids)
+    df_long = df_long.astype({'time': 'datetime64[ns]', 'sensor_id': 'int64', 'metric': 'int64', 'value': 'float64'})
+    return df_long[SENSORS_KEYS + ['value']]
+
+
+def load_sensors(start: datetime | None = None, end: datetime | None = None) -> DataFrame | None:
     df_in: DataFrame | None = None
     try:
-        if os.path.exists(SENSORS_OUTPUT_JSON_FILE):
-            df_in: DataFrame = pd.read_json(SENSORS_OUTPUT_JSON_FILE, compression='zip')
-
-        sensor_list: list[str] = []
-        for freq in get_sensors():
-            for name in get_sensors()[freq]['sensors']:
-                for loc in ['ext', 'int']:
-                    for tp in ['temp', 'humidity']:
-                        sensor_list.append(f'{loc}_{tp}_{name}')
-        sensor_list = ['time'] + sorted(sensor_list)
-
-        if df_in is None:
-            df_in = pd.DataFrame(columns=sensor_list)
-
-        df_in = df_in[sensor_list]
-        for sensor in sensor_list:
-            if 'time' != sensor:
-                if "_humidity_" in sensor:
-                    df_in = df_in.astype({sensor: 'Int64'})
-                if "_temp_" in sensor:
-                    df_in = df_in.astype({sensor: 'float64'})
-            else:
-                df_in = df_in.astype({sensor: 'datetime64[ns]'})
-        df_in = df_in[sensor_list]
+        df_in = sensors_wide(get_sensors_store().load(start=start, end=end))
     except Exception as ex:
-        log.error(' NOT JSON sensors saved '.center(100, '*'))
+        log.error(' NOT JSON sensors loaded '.center(100, '*'))
         log.error(ex)
         log.error(traceback.format_exc())
         raise ex
     return df_in
 
 
-# PURGE !???!!!!!????
-# timeout: int = int(TIMEOUT / 60)
-# df_conditional_drop = df.drop(df[
-#                                   (df['time'].dt.minute >= int32(3 * timeout)) &
-#                                   (df['time'].dt.minute <= int32(60 - timeout)) &
-#                                   (df['time'] <= (datetime.now() - relativedelta(weeks=1)))
-#                                   ].index)
-# log.info(f'Purged {len(df) - len(df_conditional_drop)} rows {len(df)}, {len(df_conditional_drop)}.')
-# df = df_conditional_drop.reset_index(drop=True)
-def load_json(thermo_pro_scan_output_json_file=THERMO_PRO_SCAN_OUTPUT_JSON_FILE) -> DataFrame:
+def sensors_wide(df_long: DataFrame | None) -> DataFrame:
+    ids: dict[str, int] = get_sensor_ids()
+
+    sensor_list: list[str] = []
+    for freq in get_sensors():
+        for name in get_sensors()[freq]['sensors']:
+            for loc in ['ext', 'int']:
+                for tp in ['temp', 'humidity']:
+                    sensor_list.append(f'{loc}_{tp}_{name}')
+
+    if df_long is None or len(df_long) == 0:
+        df_in: DataFrame = pd.DataFrame(columns=['time'] + sorted(sensor_list))
+    else:
+        # Wide view built on demand: one column per sensor, location and metric
+        names: dict[int, str] = {sensor_id: name for name, sensor_id in ids.items()}
+        df_long = df_long.copy()
+        df_long['column'] = df_long['metric'].map(dict(enumerate(SENSOR_METRICS))) + '_' + df_long[
+            'sensor_id'].map(names)
+        df_in = df_long.pivot_table(index='time', columns='column', values='value', aggfunc='last')
+        df_in = df_in.reset_index().rename_axis(columns=None)
+        # The sensors no longer in sensor_list.json keep their history
+        sensor_list.extend(col for col in df_in.columns if col != 'time' and col not in sensor_list)
+    sensor_list = ['time'] + sorted(sensor_list)
+
+    df_in = df_in.reindex(columns=sensor_list)
+    for sensor in sensor_list:
+        if 'time' != sensor:
+            if "_humidity_" in sensor:
+                df_in[sensor] = df_in[sensor].astype('float64').round().astype('Int64')
+            if "_temp_" in sensor:
+                df_in = df_in.astype({sensor: 'float64'})
+        else:
+            df_in = df_in.astype({sensor: 'datetime64[ns]'})
+    return df_in[sensor_list]
+
+
+def load_json(thermo_pro_scan_output_json_file=THERMO_PRO_SCAN_OUTPUT_JSON_FILE, start: datetime | None = None,
+              end: datetime | None = None) -> DataFrame:
     df: DataFrame | None = None
     try:
-        if os.path.exists(thermo_pro_scan_output_json_file + '.zip'):
-            log.info(f'Loading file {thermo_pro_scan_output_json_file + '.zip'}')
-            df: DataFrame = pandas.read_json(thermo_pro_scan_output_json_file + '.zip', compression='zip',
-                                             orient='records')
+        store: HistoryStore = HistoryStore()
+        if not store.exists():
+            log.warning(f'Store {THERMO_PRO_SCAN_STORE_PATH} not found, migrating {thermo_pro_scan_output_json_file}')
+            store.write(read_legacy_json(thermo_pro_scan_output_json_file))
+            Rollups().rebuild(store.load())
+        log.info(f'Loading store {THERMO_PRO_SCAN_STORE_PATH}, from: {start}, to: {end}')
+        df = store.load(start=start, end=end)
     except Exception as ex:
-        log.error(' NOT JSON zip loaded '.center(100, '*'))
+        log.error(' NOT JSON store loaded '.center(100, '*'))
         log.error(ex)
         log.error(traceback.format_exc())
-        try:
-            if os.path.exists(thermo_pro_scan_output_json_file):
-                log.info(f'Loading file {thermo_pro_scan_output_json_file}')
-                df: DataFrame = pandas.read_json(thermo_pro_scan_output_json_file, orient='records')
-        except Exception as ex:
-            log.error('NOT JSON loaded'.center(100, '*'))
-            log.error(ex)
-            log.error(traceback.format_exc())
-            raise ex
+        raise ex
 
     if df is None:
-        raise f"Unable to load file {thermo_pro_scan_output_json_file + '.zip'}"
+        raise Exception(f"Unable to load store {THERMO_PRO_SCAN_STORE_PATH}")
     else:
-        df = df[COLUMNS]
+        df = df.reindex(columns=get_columns())
         df = set_astype(df)
         for col in ['time', 'open_sunrise', 'open_sunset']:
             df = df.astype({col: 'datetime64[ns]'})
     return df
 
 
+def read_legacy_json(thermo_pro_scan_output_json_file=THERMO_PRO_SCAN_OUTPUT_JSON_FILE) -> Iterator[DataFrame]:
+    """The legacy history by chunks of typed rows: the memory used doesn't grow with the file."""
+    file: str = thermo_pro_scan_output_json_file + '.zip'
+    if not zipfile.is_zipfile(file):
+        log.error(f'NOT JSON zip: {file}')
+        file = thermo_pro_scan_output_json_file
+    if not os.path.exists(file):
+        raise Exception(f"Unable to load file {thermo_pro_scan_output_json_file + '.zip'}")
+    log.info(f'Loading file {file}')
+    for df in JsonRecordsReader(file, dtypes=SCHEMA).chunks():
+        yield set_astype(df.reindex(columns=COLUMNS))
+
+
 def save_json(df: DataFrame, thermo_pro_scan_output_json_file=THERMO_PRO_SCAN_OUTPUT_JSON_FILE) -> None:
     try:
         if df is None or len(df) == 0:
             raise Exception("The DataFrame is None. Unable to save file")
 
         df = set_astype(df)
-        df.to_json(THERMO_PRO_SCAN_OUTPUT_JSON_FILE, orient='records', indent=4, date_format='iso')
-        df.to_json(THERMO_PRO_SCAN_OUTPUT_JSON_FILE + '.zip', orient='records', indent=4, date_format='iso',
-                   compression={
-                       'method': 'zip',
-                       'compression': zipfile.ZIP_LZMA,
-                       'compresslevel': 9
-                   })
-        log.info(
-            f'JSON saved: {thermo_pro_scan_output_json_file} & zip\t\t{os.path.getsize(thermo_pro_scan_output_json_file + '.zip')} bytes')
+        HistoryStore().write(df)
+        Rollups().rebuild(df)
+        update_columns()
+        log.info(f'JSON saved: {THERMO_PRO_SCAN_STORE_PATH}\t\t{len(df)} rows')
     except Exception as ex:
         log.error(' NOT JSON saved '.center(100, '*'))
         log.error(ex)
@@ -204,6 +265,110 @@ def save_json(df: DataFrame, thermo_pro_scan_output_json_file=THERMO_PRO_SCAN_OU
         raise ex
 
 
+def query(columns: list[str] | None = None, start: datetime | None = None, end: datetime | None = None,
+          resample: str | None = None) -> DataFrame:
+    columns = ['time'] + [col for col in (columns if columns else get_columns()) if col != 'time']
+    try:
+        if not HistoryStore().exists():
+            load_json(start=start, end=end)
+        df: DataFrame | None = HistoryStore().load(start=start, end=end, columns=columns)
+    except Exception as ex:
+        log.error(' NOT JSON store queried '.center(100, '*'))
+        log.error(ex)
+        log.error(traceback.format_exc())
+        raise ex
+
+    if df is None:
+        raise Exception(f"Unable to query store {THERMO_PRO_SCAN_STORE_PATH}")
+    df = set_astype(df)[columns].reset_index(drop=True)
+    if resample is not None:
+        df = df.resample(resample, on='time').mean(numeric_only=True).reset_index()
+    log.info(f'Query: {len(df)} rows, {len(columns)} columns, from: {start}, to: {end}, resample: {resample}')
+    return df
+
+
+def append_json(df: DataFrame) -> None:
+    try:
+        if df is None or len(df) == 0:
+            log.info('Nothing to append')
+            return
+
+        df = set_astype(df)
+        store: HistoryStore = HistoryStore()
+        version: int = store.read_manifest()['version']
+        store.append(df)
+        get_dataset().apply(df, version, store.read_manifest()['version'])
+        Rollups().update(df)
+        update_columns(df)
+        log.info(f'JSON appended: {len(df)} rows to {THERMO_PRO_SCAN_STORE_PATH}')
+    except Exception as ex:
+        log.error(' NOT JSON appended '.center(100, '*'))
+        log.error(ex)
+        log.error(traceback.format_exc())
+        raise ex
+
+
+def update_columns(df: DataFrame | None = None) -> None:
+    """Brings the memory-mapped copy of the history to the version of the store, df: the rows just written."""
+    try:
+        columnar_file: ColumnarFile = ColumnarFile(THERMO_PRO_SCAN_COLUMNS_PATH)
+        version: int = HistoryStore().read_manifest()['version']
+        if df is None or not columnar_file.upsert(set_astype(df.copy()), version):
+            columnar_file.rebuild(get_dataset().get(), version)
+    except Exception as ex:
+        log.error(ex)
+        log.error(traceback.format_exc())
+
+
+def update_sensors_columns(df_long: DataFrame | None = None) -> None:
+    try:
+        columnar_file: ColumnarFile = ColumnarFile(SENSORS_COLUMNS_PATH)
+        version: int = get_sensors_store().read_manifest()['version']
+        if df_long is None or not columnar_file.upsert(sensors_wide(df_long), version):
+            columnar_file.rebuild(load_sensors(), version)
+    except Exception as ex:
+        log.error(ex)
+        log.error(traceback.format_exc())
+
+
+def compact() -> dict[str, int]:
+    log.warning(' Start compact '.center(100, '*'))
+    result: dict[str, int] = {'segments': 0, 'rows': 0, 'pending_bytes': 0}
+    try:
+        for store in [HistoryStore(), get_sensors_store()]:
+            if store.exists():
+                for key, value in store.compact(RETENTION_POLICIES).items():
+                    result[key] += value
+        if result['rows'] > 0:
+            update_columns()
+            update_sensors_columns()
+        log.warning(f'Compacted: {result['segments']} segments, {result['rows']} rows and '
+                    f'{round(result['pending_bytes'] / 1024)} KB to reclaim once the replaced segments are removed')
+    except Exception as ex:
+        log.error(ex)
+        log.error(traceback.format_exc())
+    log.warning(' End compact '.center(100, '*'))
+    return result
+
+
+def upsert_json(column: str, values: pd.Series) -> DataFrame:
+    try:
+        store: HistoryStore = HistoryStore()
+        version: int = store.read_manifest()['version']
+        df: DataFrame = store.upsert(column, values)
+        if len(df) > 0:
+            get_dataset().apply(df, version, store.read_manifest()['version'])
+            Rollups().update(set_astype(df))
+            update_columns(df)
+        log.info(f'JSON upserted: {len(df)} {column} cells to {THERMO_PRO_SCAN_STORE_PATH}')
+        return df
+    except Exception as ex:
+        log.error(' NOT JSON upserted '.center(100, '*'))
+        log.error(ex)
+        log.error(traceback.format_exc())
+        raise ex
+
+
 def display_schedule() -> None:
     log.info('Schedule set:')
     for job in schedule.get_jobs():
@@ -231,7 +396,7 @@ def save_bkp() -> None:
 
         file_name = 'ThermoProScan'
         zip_file_name = f'{BKP_PATH}/{file_name}_{datetime.now().strftime('%Y-%m-%d')}.zip'
-        with zipfile.ZipFile(zip_file_name, "a", compression=zipfile.ZIP_LZMA, compresslevel=9) as zip_file:
+        with zipfile.ZipFile(zip_file_name, "a", **Codec.for_use('backup', zip_member=True).zip_args()) as zip_file:
             for file in out_file_list:
                 zip_file.write(file, arcname=file[file.replace('\\', '/').rfind('/') + 1:])
 
@@ -242,6 +407,15 @@ def save_bkp() -> None:
                     compressed += info.compress_size / 1024
             log.info(
                 f"Zipped files, original: {round(original, 2)} Ko, compressed: {round(compressed, 2)} Ko. ratio: {round(100 - (compressed / original) * 100, 2)}%")
+            names: list[str] = zip_file.namelist()
+            for file in HistoryStore().files() + get_sensors_store().files():
+                arcname: str = file[len(POIDS_PRESSION_PATH):]
+                if file.endswith('.zip'):
+                    if arcname not in names:  # sealed segments never change
+                        zip_file.write(file, arcname=arcname)
+                else:
+                    zip_file.write(file, arcname=arcname[:arcname.rindex('.')] + datetime.now().strftime(
+                        '_%Y-%m-%d_%H-%M-%S') + arcname[arcname.rindex('.'):])
             log.info(f"Zip file created at: {zip_file_name}")
 
         try:
@@ -310,44 +484,40 @@ def copy_to_cloud() -> None:
 
 
 def set_astype(df: DataFrame) -> DataFrame:
-    columns = list(COLUMNS)
-    for col in ['time', 'open_sunrise', 'open_sunset']:
-        df = df.astype({col: 'datetime64[ns]'})
-        columns.remove(col)
-    for col in ['ext_humidex', 'ext_humidity', 'int_humidity', 'open_clouds', 'open_humidity', 'open_pressure',
-                'open_visibility', 'open_wind_deg']:
-        try:
-            df[col] = df[col].round().astype('Int64')
-            df[col] = df[col].apply(lambda x: 0 if pd.isna(x) else x)
-        except KeyError as ex:
-            log.error(f'{col} -> {df.columns}')
-            log.error(ex)
-            log.error(traceback.format_exc())
-        columns.remove(col)
-    for col in ['open_description', 'open_icon']:
-        df[col] = df[col].astype(str)
-        columns.remove(col)
-    for col in columns:
-        try:
-            df[col] = df[col].astype('Float64')
-            df[col] = df[col].apply(lambda x: 0.0 if pd.isna(x) else x)
-        except KeyError as ex:
-            log.error(df[col].dtypes)
-            log.error(ex)
-            log.error(traceback.format_exc())
+    schema: dict[str, str] = {col: dtype for col, dtype in SCHEMA.items() if col in df.columns}
+    ints: list[str] = [col for col, dtype in schema.items() if dtype == 'int64']
+    floats: list[str] = [col for col, dtype in schema.items() if dtype == 'float64']
+
+    df = df.astype({col: 'float64' for col in ints + floats})
+    df[ints] = df[ints].fillna(0.0).round()
+    df = df.astype(schema)
+    # Null stays null in the columns added at run time
+    df = df.astype({col: column_dtype(col) for col in df.columns if col not in schema and column_dtype(col)})
 
-    df.set_index('time')
     all_columns2: list[str] = sorted(df.columns.tolist())
     all_columns2.remove('time')
     all_columns2 = ['time'] + all_columns2
     df = df[all_columns2]
     df = df.sort_values(by='time', ascending=True)
-    df['kwh_hydro_quebec'] = df['kwh_hydro_quebec'].apply(lambda x: 0.0 if pd.isna(x) else x)
-    df['kwh_neviweb'] = df['kwh_neviweb'].apply(lambda x: 0.0 if pd.isna(x) else x)
 
     return df
 
 
+def column_dtype(col: str) -> str | None:
+    """dtype of a column of SCHEMA or DYNAMIC_COLUMNS, None for a key that is not a column."""
+    if col in SCHEMA:
+        return SCHEMA[col]
+    for prefix, dtype in DYNAMIC_COLUMNS.items():
+        if col.startswith(prefix):
+            return dtype
+    return None
+
+
+def get_columns() -> list[str]:
+    """COLUMNS, then the columns added since to the catalog of the store."""
+    return COLUMNS + sorted(col for col in HistoryStore().columns() if col not in COLUMNS and column_dtype(col))
+
+
 def show_df(df: DataFrame | None, title='', max_columns=None, width=1000, max_rows=50) -> None:
     if df is None:
         log.warning(f'>>>> {title} DataFrame is None')
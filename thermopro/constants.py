@@ -27,17 +27,106 @@ COLUMNS: list[str] = (
         )
 )
 
+# dtype of every column of COLUMNS. A missing int is stored as 0, a missing float stays null: a source not in the row
+# yet is a gap of the graphs, not a 0
+DATE_COLUMNS: list[str] = ['time', 'open_sunrise', 'open_sunset']
+INT_COLUMNS: list[str] = ['ext_humidex', 'ext_humidity', 'int_humidity', 'open_clouds', 'open_humidity', 'open_pressure',
+                          'open_visibility', 'open_wind_deg']
+STR_COLUMNS: list[str] = ['open_description', 'open_icon']
+SCHEMA: dict[str, str] = {
+    col: 'datetime64[ns]' if col in DATE_COLUMNS else 'int64' if col in INT_COLUMNS else 'str' if col in STR_COLUMNS
+    else 'float64' for col in COLUMNS
+}
+
+# Columns a source adds at run time, by prefix: one per Neviweb group. They go in the catalog of the store when they
+# first show up, the older rows read them as null (not 0 like the columns of SCHEMA)
+DYNAMIC_COLUMNS: dict[str, str] = {'int_temp_': 'float64', 'kwh_': 'float64'}
+
+# A 0 in these columns means the source did not answer, it is left out of the means
+ZERO_IS_MISSING: list[str] = ['ext_humidity', 'int_humidity', 'int_temp', 'open_feels_like', 'open_humidity',
+                              'ext_humidex']
+
 THERMO_PRO_SCAN_OUTPUT_JSON_FILE = f"{POIDS_PRESSION_PATH}ThermoProScan.json"
 SENSORS_OUTPUT_JSON_FILE = f"{POIDS_PRESSION_PATH}Sensors.json.zip"
 
+# Append-only history store partitioned by month: rows go to a small active log, sealed at the end of the month
+# (or after SEGMENT_ROWS rows), sealed segments are never rewritten
+THERMO_PRO_SCAN_STORE_PATH = f"{POIDS_PRESSION_PATH}ThermoProScan"
+SEGMENT_ROWS: int = 24 * 31
+# Codecs of each use, the first one available wins (zstd needs the zstandard package), see Benchmark.py codecs:
+# segment -> members of the sealed segments, written while scanning: fast
+# backup  -> daily zip of save_bkp, written 4 times a day and kept BKP_DAYS days: strong
+CODECS: dict[str, list[str]] = {'segment': ['zstd-3', 'deflate-6'], 'backup': ['zstd-19', 'lzma-9']}
+# Format of the new sealed segments: 'encoded' (binary columns, see ColumnEncoding) or 'columns' (JSON columns)
+SEGMENT_FORMAT: str = 'encoded'
+# Retention of the sealed months: (age in days, samples per day kept beyond that age), run by thermopro.compact()
+RETENTION_POLICIES: list[tuple[int, int]] = [(365, 4)]
+
+# Fixed layout copies of the history and of the wide view of the sensors, memory-mapped by the graphs
+THERMO_PRO_SCAN_COLUMNS_PATH = f"{POIDS_PRESSION_PATH}ThermoProScan.columns"
+SENSORS_COLUMNS_PATH = f"{POIDS_PRESSION_PATH}Sensors.columns"
+
+# Long-format store of the rtl_433 readings: one (time, sensor_id, metric, value) row per reading
+SENSORS_STORE_PATH = f"{POIDS_PRESSION_PATH}Sensors"
+SENSORS_KEYS: list[str] = ['time', 'sensor_id', 'metric']
+SENSOR_METRICS: list[str] = ['ext_temp', 'ext_humidity', 'int_temp', 'int_humidity']
+
 LOCATION = f'{HOME_PATH}/Documents/NetBeansProjects/PycharmProjects/ThermoPro/'
 
 OUTPUT_RTL_433_FILE: str = f"{os.getenv('TEMP')}/rtl_433.json"
 # RTL_433_VERSION = '25.12'
 RTL_433_VERSION = 'nightly'
 TIMEOUT: int = 5 * 60
+# Most seconds a source of the scan may take before it is cancelled, see Collector. rtl_433: up to TIMEOUT per frequency
+SOURCE_TIMEOUTS: dict[str, float] = {'rtl_433': 2 * TIMEOUT + 60, 'neviweb': 3 * 60, 'open_weather': 60,
+                                     'hydro_quebec': 3 * 60}
+# Seconds after the start of the scan the row waits for a source, it is committed without the later ones and patched
+# when they answer (within SOURCE_TIMEOUTS): the row doesn't wait for a stuck source. rtl_433: a whole capture
+SOURCE_DEADLINES: dict[str, float] = {'rtl_433': 2 * TIMEOUT + 30, 'neviweb': 45, 'open_weather': 15,
+                                      'hydro_quebec': 60}
+# Always-on capture (Rtl433Daemon) instead of one rtl_433 run per scan, opt-in: it keeps the SDR busy between the scans
+RTL_433_DAEMON: bool = False
+# Seconds between two polls of a source, and how long its last values stay good enough for the hourly row, see Source.
+# Polled in the background when more often than hourly. Hydro-Québec fetches 4 weeks of data: every 6 hours is enough.
+# rtl_433 is a capture of minutes, once per scan with a TTL under the hour, unless the daemon captures all along
+SOURCE_CADENCES: dict[str, float] = {'rtl_433': 30 * 60 if RTL_433_DAEMON else 60 * 60, 'neviweb': 60 * 60,
+                                     'open_weather': 15 * 60, 'hydro_quebec': 6 * 60 * 60}
+SOURCE_TTLS: dict[str, float] = {'rtl_433': 35 * 60 if RTL_433_DAEMON else 50 * 60, 'neviweb': 0,
+                                 'open_weather': 20 * 60, 'hydro_quebec': 6 * 60 * 60}
 RTL_433_EXE_PATH: str = f"{HOME_PATH}/Documents/NetBeansProjects/rtl_433-win-x64-{RTL_433_VERSION}/rtl_433_64bit_static.exe"
 RTL_433_EXE = RTL_433_EXE_PATH[RTL_433_EXE_PATH.rfind('/') + 1:]
+# A reading older than RTL_433_MAX_AGE seconds is not used, RTL_433_DWELL: seconds on a band at most when
+# sensor_list.json has several bands for one SDR
+RTL_433_MAX_AGE: int = 30 * 60
+RTL_433_DWELL: int = TIMEOUT
+# rtl_433 -F json read from its stdout (Rtl433Reader) instead of tailing OUTPUT_RTL_433_FILE
+RTL_433_PIPE: bool = True
+# Seconds (first, most) before rtl_433 is started again after it exited, doubled at each exit after a short run
+RTL_433_BACKOFF: tuple[int, int] = (5, 5 * 60)
+# All the bands of sensor_list.json captured at once instead of one after the other, see Rtl433Supervisor.captures:
+# one SDR per band when every band has one here (band: serial or index for rtl_433 -d), else one SDR hopping between
+# the bands every RTL_433_HOP seconds (rtl_433 -H). 0: no hopping
+RTL_433_DEVICES: dict[str, str] = {}
+RTL_433_HOP: int = 0
+# Value of a sensor (SensorWindow): weighted median of its last RTL_433_WINDOW_SIZE distinct frames heard within
+# RTL_433_WINDOW seconds, a repeated frame adds to the weight of the first one. The hourly capture waits RTL_433_BURST
+# seconds after the first frame of a sensor for the repeats. A value out of RTL_433_BOUNDS is dropped, one further than
+# RTL_433_MAD_K MAD (at least RTL_433_MAD_MIN) from the median is ignored
+RTL_433_WINDOW: int = 10 * 60
+RTL_433_WINDOW_SIZE: int = 16
+RTL_433_BURST: float = 2
+RTL_433_BOUNDS: dict[str, tuple[float, float]] = {'temperature_C': (-50, 70), 'humidity': (0, 100)}
+RTL_433_MAD_K: float = 3.5
+RTL_433_MAD_MIN: dict[str, float] = {'temperature_C': 0.2, 'humidity': 1}
+# Transmit period and phase of each sensor, learned from its arrivals (TransmitSchedule): the hourly capture starts
+# rtl_433 RTL_433_LEAD seconds before the first transmission expected, stops it while the next one is more than
+# RTL_433_IDLE seconds away, and stops waiting for a sensor RTL_433_LATE_PERIODS periods after it was expected (late)
+TRANSMIT_SCHEDULE_FILE = f"{POIDS_PRESSION_PATH}TransmitSchedule.json"
+RTL_433_LEAD: float = 5
+RTL_433_IDLE: float = 30
+RTL_433_LATE_PERIODS: float = 2
+# Seconds a band is listened to with all the decoders by Rtl433Calibration, at most, to find the -R of its sensors
+RTL_433_CALIBRATION: int = 15 * 60
 
 DAYS_PER_MONTH = 30.437  # https://www.britannica.com/science/time/Standard-time
 